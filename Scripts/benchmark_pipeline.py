@@ -0,0 +1,152 @@
+"""
+Replays recorded experiments through DataStreamer without the UI and reports per-stage latency,
+end-to-end latency, throughput and peak memory as JSON.
+
+With --rate 0 the experiments are replayed as fast as possible, which measures the maximum sample rate;
+end-to-end latency then includes the time samples wait in the queue. Replay at a finite rate
+(e.g. --rate 10) to measure latency under a realistic load.
+An experiment whose replay lost aligned data (gap rows or late samples) is flagged with a warning, since its
+figures no longer describe the whole recording; --packet-loss and --jitter-ms cause some on purpose.
+
+    python Scripts/benchmark_pipeline.py --rate 0 --output benchmark_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'System'))
+from DataStreamer import DataStreamer
+from ReplayConnection import ReplayConnectionList
+
+STAGES = ['segment assembly', 'smoothen', 'feature extraction', 'scaling', 'prediction', 'latency']
+
+
+def find_experiments(participants_folder):
+    experiments = []
+    for individual_folder in sorted(os.listdir(participants_folder)):
+        if 'individual' not in individual_folder:
+            continue
+        for experiment_folder in sorted(os.listdir(f'{participants_folder}/{individual_folder}')):
+            folder_path = f'{participants_folder}/{individual_folder}/{experiment_folder}'
+            if 'experiment' in experiment_folder and os.path.exists(f'{folder_path}/imu_data.csv'):
+                experiments.append(folder_path)
+    return experiments
+
+
+def summarize(values):
+    values_ms = np.array(values) * 1000
+    if len(values_ms) == 0:
+        return {'count': 0}
+    return {
+        'count': len(values_ms),
+        'mean_ms': float(np.mean(values_ms)),
+        'p50_ms': float(np.percentile(values_ms, 50)),
+        'p95_ms': float(np.percentile(values_ms, 95)),
+        'p99_ms': float(np.percentile(values_ms, 99)),
+        'max_ms': float(np.max(values_ms)),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_experiment(folder_path, args):
+    connections = ReplayConnectionList(folder_path, rate=args.rate, jitter_ms=args.jitter_ms,
+                                       packet_loss=args.packet_loss, seed=args.seed)
+    data_streamer = DataStreamer(connections.get_wrist_connection(), connections.get_arm_connection(),
+                                 incremental=not args.full_replay, backend=args.backend,
+                                 queue_size=args.queue_size, model_folder=args.model_folder,
+                                 # off real time, the device clocks cannot be mapped through arrival times
+                                 replay_clock=args.rate != 1)
+    start = time.perf_counter()
+    connections.openAll()
+    connections.join()
+    data_streamer.stop()
+    elapsed = time.perf_counter() - start
+
+    stats = data_streamer.pipeline_stats()
+    result = {
+        'experiment': os.path.relpath(folder_path, args.participants_folder),
+        'samples': stats['processed samples'],
+        'repetitions': len(data_streamer.intervals),
+        'elapsed_s': elapsed,
+        'samples_per_second': stats['processed samples'] / elapsed,
+        'max_queue_depth': stats['max queue depth'],
+        'dropped_samples': sum(stats['dropped samples'].values()),
+        'aligned_rows': stats['alignment']['rows'],
+        'gap_rows': stats['alignment']['gap rows'],
+        'late_samples': stats['alignment']['late samples'],
+    }
+    return result, data_streamer.stage_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--participants-folder', default=os.path.join(REPO_ROOT, 'Data', 'Participants'))
+    parser.add_argument('--model-folder', default=os.path.join(REPO_ROOT, 'System', 'models'))
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='keras')
+    parser.add_argument('--full-replay', action='store_true', help='replay the whole session through the RNN every repetition')
+    parser.add_argument('--rate', type=float, default=0, help='playback speed, 0 for as fast as possible')
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--packet-loss', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queue-size', type=int, default=10**6)
+    parser.add_argument('--limit', type=int, default=None, help='only replay the first N experiments')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+    args.rate = args.rate or None
+
+    experiments = find_experiments(args.participants_folder)[:args.limit]
+    stage_times = defaultdict(list)
+    results = []
+    warnings = []
+    for folder_path in experiments:
+        result, experiment_stage_times = run_experiment(folder_path, args)
+        for stage, times in experiment_stage_times.items():
+            stage_times[stage].extend(times)
+        results.append(result)
+        print(f"{result['experiment']}: {result['repetitions']} repetitions, "
+              f"{result['samples_per_second']:.0f} samples/s, dropped {result['dropped_samples']}")
+        if result['gap_rows'] > 0 or result['late_samples'] > 0 or result['dropped_samples'] > 0:
+            warnings.append(f"{result['experiment']}: {result['gap_rows']} of {result['aligned_rows']} aligned rows are gaps, "
+                            f"{result['late_samples']} samples arrived late and {result['dropped_samples']} were dropped")
+
+    total_samples = sum(result['samples'] for result in results)
+    total_elapsed = sum(result['elapsed_s'] for result in results)
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ['output']},
+        'experiments': len(results),
+        'stages': {stage: summarize(stage_times[stage]) for stage in STAGES},
+        'samples_per_second': total_samples / total_elapsed if total_elapsed > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'per_experiment': results,
+        'warnings': warnings,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for stage in STAGES:
+        summary = report['stages'][stage]
+        if summary['count'] > 0:
+            print(f"{stage:>20}: p50 {summary['p50_ms']:.3f} ms, p95 {summary['p95_ms']:.3f} ms, p99 {summary['p99_ms']:.3f} ms")
+    print(f"{report['samples_per_second']:.0f} samples/s, peak RSS {report['peak_rss_mb']:.0f} MB, saved {args.output}")
+    for warning in warnings:
+        print(f'WARNING: {warning}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
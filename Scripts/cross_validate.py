@@ -0,0 +1,263 @@
+"""
+Leave-individuals-out cross-validation of the fatigue RNN of train_rnn.ipynb.
+
+The training participants are split into K folds of whole individuals. Each fold trains the same model as the
+notebook (two Adam stages with the best checkpoint kept) on the other folds and is scored on its own individuals,
+with the folds trained concurrently in a process pool and a fixed number of TensorFlow threads per worker.
+The padded tensors and the fitted StandardScaler of every fold are cached, so repeated runs skip preprocessing.
+Training and scoring batch experiments in length buckets (length_buckets.py) unless --buckets 0 pads everything
+to the longest sequence as the notebook does.
+Prints the per-fold MSE table and the wall-clock speedup over training the folds one after another, and copies
+the checkpoint and scaler of the best fold to the output folder.
+
+    python Scripts/cross_validate.py --folds 5 --workers 5 --threads-per-worker 2
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.preprocessing import StandardScaler
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'System'))
+from FeaturePlan import FEATURE_MANIFEST, load_feature_manifest
+from FeatureStore import FeatureStore
+from length_buckets import BucketedBatches, as_keras_dataset, epoch_timer, padded_fraction, predict_bucketed
+
+TRAIN_PARTICIPANTS = ['individual_00','individual_01','individual_02','individual_05','individual_06','individual_07','individual_08','individual_10','individual_11','individual_12','individual_13','individual_15','individual_16','individual_18','individual_19','individual_20','individual_21','individual_22','individual_23','individual_24','individual_25','individual_26','individual_27','individual_28','individual_29','individual_31','individual_32','individual_33','individual_34','individual_36','individual_37','individual_39','individual_40','individual_42','individual_44','individual_45','individual_48','individual_50','individual_56','individual_57','individual_58','individual_60','individual_61','individual_62','individual_63','individual_64','individual_66']
+# only keep participant data up to level 7 fatigue
+FATIGUE_THRESHOLD = 7
+# part of the fold cache key; bump when the cached arrays change
+CACHE_VERSION = 2
+
+
+def load_experiments(store, individuals, threshold=FATIGUE_THRESHOLD):
+    """
+    {individual: [(X, y), ...]} with every experiment cut before its first Borg value >= threshold,
+    dropping experiments that start there (as train_rnn.ipynb does).
+    """
+    experiments = {}
+    for individual in individuals:
+        experiments[individual] = []
+        for experiment_X, experiment_y in zip(*store.experiments([individual])):
+            index = np.argmax(experiment_y >= threshold)
+            if index > 0:
+                experiments[individual].append((experiment_X[:index], experiment_y[:index]))
+    return experiments
+
+
+def make_folds(individuals, num_folds, seed):
+    shuffled = np.random.default_rng(seed).permutation(individuals)
+    return [sorted(fold.tolist()) for fold in np.array_split(shuffled, num_folds)]
+
+
+def pad(sequences, max_seq, value=-1):
+    """
+    Post-pads (length, ...) sequences to (len(sequences), max_seq, ...) float32, like pad_sequences(padding='post').
+    """
+    trailing_shape = sequences[0].shape[1:] if sequences else ()
+    padded = np.full((len(sequences), max_seq) + trailing_shape, value, dtype='float32')
+    for i, sequence in enumerate(sequences):
+        padded[i, :len(sequence)] = sequence[:max_seq]
+    return padded
+
+
+def prepare_fold(experiments, val_individuals, max_seq, features, cache_path):
+    """
+    Fits the scaler on the training individuals, scales, pads and caches both sides of one fold.
+    """
+    train = [experiment for individual, individual_experiments in experiments.items()
+             if individual not in val_individuals for experiment in individual_experiments]
+    val = [experiment for individual in val_individuals for experiment in experiments[individual]]
+    scaler = StandardScaler()
+    scaler.fit(np.concatenate([X for X, y in train], axis=0))
+    np.savez(f'{cache_path}.npz',
+             train_X=pad([scaler.transform(X)[:, features] for X, y in train], max_seq),
+             train_y=pad([y[:, np.newaxis] for X, y in train], max_seq),
+             val_X=pad([scaler.transform(X)[:, features] for X, y in val], max_seq),
+             val_y=pad([y[:, np.newaxis] for X, y in val], max_seq),
+             train_lengths=np.array([len(y) for X, y in train]),
+             val_lengths=np.array([len(y) for X, y in val]))
+    joblib.dump(scaler, f'{cache_path}.scaler.pkl')
+
+
+def fold_cache_key(store, val_individuals, train_individuals, max_seq, features):
+    digest = hashlib.sha256(json.dumps([val_individuals, train_individuals, max_seq, features, FATIGUE_THRESHOLD, CACHE_VERSION]).encode())
+    for name in ['index.npy', 'X.npy', 'y.npy']:
+        with open(f'{store.store_folder}/{name}', 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def prepare_folds(store, experiments, folds, max_seq, features, cache_folder):
+    """
+    Cache paths of every fold, preparing the folds that are not cached yet. Returns (cache_paths, cache_hits).
+    """
+    individuals = [individual for individual in experiments if len(experiments[individual]) > 0]
+    cache_paths, cache_hits = [], 0
+    for val_individuals in folds:
+        train_individuals = [individual for individual in individuals if individual not in val_individuals]
+        key = fold_cache_key(store, val_individuals, train_individuals, max_seq, features)
+        cache_path = f'{cache_folder}/fold_{key}'
+        if os.path.exists(f'{cache_path}.npz') and os.path.exists(f'{cache_path}.scaler.pkl'):
+            cache_hits += 1
+        else:
+            prepare_fold(experiments, val_individuals, max_seq, features, cache_path)
+        cache_paths.append(cache_path)
+    return cache_paths, cache_hits
+
+
+def init_tensorflow(threads, seed=None):
+    """
+    Imports TensorFlow in a worker process with a fixed number of threads.
+    """
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+    if seed is not None:
+        tf.keras.utils.set_random_seed(seed)
+
+
+def build_rnn(num_features, max_seq=None):
+    """
+    The model of train_rnn.ipynb; max_seq None accepts any sequence length (for length-bucketed batches).
+    """
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Masking, LSTM, Dense, Input
+    rnn_model = Sequential()
+    rnn_model.add(Input(shape=(max_seq, num_features)))
+    rnn_model.add(Masking(mask_value=-1))
+    rnn_model.add(LSTM(64, return_sequences=True))
+    rnn_model.add(Dense(1))
+    return rnn_model
+
+
+def train_fold(fold, cache_path, checkpoint_path, epochs, batch_size, num_buckets, threads, seed):
+    """
+    Trains one fold in a worker process and returns its validation metrics.
+    """
+    init_tensorflow(threads, seed + fold)
+    from tensorflow.keras.models import load_model
+    from tensorflow.keras.callbacks import ModelCheckpoint
+    from tensorflow.keras.losses import LogCosh
+    from tensorflow.keras.optimizers import Adam
+
+    start = time.perf_counter()
+    data = np.load(f'{cache_path}.npz')
+    train_X, train_y, val_X, val_y = data['train_X'], data['train_y'], data['val_X'], data['val_y']
+    train_lengths, val_lengths = data['train_lengths'], data['val_lengths']
+    num_experiments, num_reps, num_features = train_X.shape
+    # with buckets every batch has its own length
+    rnn_model = build_rnn(num_features, None if num_buckets else num_reps)
+
+    epoch_times = []
+    checkpoint = ModelCheckpoint(filepath=checkpoint_path, monitor='val_loss', save_best_only=True, mode='min', verbose=0)
+    if num_buckets:
+        train_batches = BucketedBatches([train_X[i, :length] for i, length in enumerate(train_lengths)],
+                                        [train_y[i, :length] for i, length in enumerate(train_lengths)],
+                                        batch_size, num_buckets, seed=seed + fold)
+        val_batches = BucketedBatches([val_X[i, :length] for i, length in enumerate(val_lengths)],
+                                      [val_y[i, :length] for i, length in enumerate(val_lengths)],
+                                      batch_size, num_buckets)
+        train_padding = train_batches.padded_fraction()
+    else:
+        train_padding = padded_fraction(train_lengths, max_seq=num_reps)
+    for learning_rate in [0.001, 0.0001]:
+        rnn_model.compile(optimizer=Adam(learning_rate=learning_rate), loss=LogCosh())
+        if num_buckets:
+            rnn_model.fit(as_keras_dataset(train_batches), epochs=epochs, validation_data=as_keras_dataset(val_batches),
+                          callbacks=[checkpoint, epoch_timer(epoch_times)], verbose=0)
+        else:
+            rnn_model.fit(train_X, train_y, epochs=epochs, batch_size=batch_size, validation_data=(val_X, val_y),
+                          callbacks=[checkpoint, epoch_timer(epoch_times)], verbose=0)
+
+    # score the best checkpoint, per experiment as in the test loop of train_rnn.ipynb
+    rnn_model = load_model(checkpoint_path)
+    val_sequences = [val_X[i, :length] for i, length in enumerate(val_lengths)]
+    if num_buckets:
+        predictions = predict_bucketed(rnn_model, val_sequences, batch_size, num_buckets)
+    else:
+        padded_predictions = rnn_model.predict(val_X, verbose=0)
+        predictions = [padded_predictions[i, :length, 0] for i, length in enumerate(val_lengths)]
+    mses = [float(np.mean((predictions[i] - val_y[i, :length, 0]) ** 2)) for i, length in enumerate(val_lengths)]
+    return {'fold': fold, 'experiments': len(mses), 'mse': float(np.mean(mses)), 'mse std': float(np.std(mses)),
+            'train padding': float(train_padding), 'epoch seconds': float(np.mean(epoch_times)),
+            'train seconds': time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--features-folder', default=os.path.join(REPO_ROOT, 'Data', 'Features Data'))
+    parser.add_argument('--participants', nargs='+', default=TRAIN_PARTICIPANTS)
+    parser.add_argument('--features-manifest', default=FEATURE_MANIFEST, help='feature indices to train on (default: System/models/features.json)')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help='parallel folds (default: one per fold, at most the CPU count)')
+    parser.add_argument('--threads-per-worker', type=int, default=None, help='TensorFlow threads per fold (default: CPUs / workers)')
+    parser.add_argument('--epochs', type=int, default=200, help='epochs per learning rate stage')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--buckets', type=int, default=4, help='length buckets per epoch, 0 to pad every experiment to the longest')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache-folder', default=None, help='default: <features folder>/cv_cache')
+    parser.add_argument('--output-folder', default=os.path.join(REPO_ROOT, 'cv_results'))
+    args = parser.parse_args()
+    num_cpus = os.cpu_count()
+    workers = args.workers or max(1, min(args.folds, num_cpus))
+    threads = args.threads_per_worker or max(1, num_cpus // workers)
+    cache_folder = args.cache_folder or f'{args.features_folder}/cv_cache'
+    os.makedirs(cache_folder, exist_ok=True)
+    os.makedirs(args.output_folder, exist_ok=True)
+
+    start = time.perf_counter()
+    selected_features = load_feature_manifest(args.features_manifest)['feature_indices']
+    store = FeatureStore(args.features_folder)
+    experiments = load_experiments(store, args.participants)
+    individuals = [individual for individual in args.participants if len(experiments[individual]) > 0]
+    # the longest sequence in all of the data is used for RNN padding
+    max_seq = max(len(y) for individual in individuals for X, y in experiments[individual])
+    folds = make_folds(individuals, args.folds, args.seed)
+
+    cache_paths, cache_hits = prepare_folds(store, experiments, folds, max_seq, selected_features, cache_folder)
+    print(f'{len(folds)} folds over {len(individuals)} individuals, {cache_hits} cached, '
+          f'prepared in {time.perf_counter() - start:.2f} s; {workers} workers x {threads} threads')
+
+    results = []
+    train_start = time.perf_counter()
+    # spawn, because TensorFlow does not survive fork once it has been initialized
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(train_fold, fold, cache_paths[fold], f'{args.output_folder}/fold_{fold}.keras',
+                                   args.epochs, args.batch_size, args.buckets, threads, args.seed)
+                   for fold in range(len(folds))]
+        for future in as_completed(futures):
+            result = future.result()
+            result['individuals'] = ' '.join(folds[result['fold']])
+            results.append(result)
+            print(f"fold {result['fold']}: MSE {result['mse']:.3f} +/- {result['mse std']:.3f} "
+                  f"over {result['experiments']} experiments in {result['train seconds']:.0f} s "
+                  f"({result['epoch seconds'] * 1000:.0f} ms per epoch, {result['train padding']:.0%} padding)")
+    wall_time = time.perf_counter() - train_start
+
+    table = pd.DataFrame(results).sort_values('fold').set_index('fold')
+    table.to_csv(f'{args.output_folder}/cv_mse.csv')
+    serial_time = table['train seconds'].sum()
+    print(table[['experiments', 'mse', 'mse std', 'train padding', 'epoch seconds', 'train seconds']].to_string())
+    print(f"Average MSE: {table['mse'].mean():.3f} +/- {table['mse'].std():.3f} across folds")
+    print(f'training wall time {wall_time:.0f} s for {serial_time:.0f} s of fold time ({serial_time / wall_time:.1f}x speedup)')
+
+    best_fold = int(table['mse'].idxmin())
+    shutil.copy(f'{args.output_folder}/fold_{best_fold}.keras', f'{args.output_folder}/rnn.keras')
+    shutil.copy(f'{cache_paths[best_fold]}.scaler.pkl', f'{args.output_folder}/scaler.pkl')
+    shutil.copy(args.features_manifest, f'{args.output_folder}/features.json')
+    print(f'best fold {best_fold}: saved rnn.keras, scaler.pkl and features.json to {args.output_folder}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Searches for the subset of the 275 features the fatigue RNN takes, and writes it as a feature manifest that
+train_rnn.ipynb, cross_validate.py and DataStreamer read (System/models/features.json).
+
+The folds of cross_validate.py are prepared once with every feature scaled and padded, and cached. A candidate
+subset only selects columns of those cached tensors, which each worker process loads once and reuses for every
+candidate it evaluates, so no candidate repeats the preprocessing.
+
+- permutation: trains one model on all features per fold, then scores each feature by how much the validation MSE
+  rises when its values are shuffled across the validation timesteps, and keeps the --size most important.
+- greedy: forward selection among the --candidates most important features by permutation. Each step trains every
+  remaining candidate added to the current subset on all folds, in parallel, and keeps the one with the lowest mean
+  validation MSE, until --size features or no improvement.
+
+The manifest is written to the output folder with the importances and scores. Copy it to System/models/features.json
+and retrain (train_rnn.ipynb saves it next to rnn.keras) to put the selection online.
+
+    python Scripts/feature_search.py --method greedy --size 13 --workers 8 --threads-per-worker 1
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'System'))
+from FeaturePlan import IMU_COLUMNS, STATISTICS, save_feature_manifest
+from FeatureStore import FeatureStore
+from cross_validate import TRAIN_PARTICIPANTS, build_rnn, init_tensorflow, load_experiments, make_folds, prepare_folds
+from length_buckets import BucketedBatches, as_keras_dataset, predict_bucketed
+
+NUM_FEATURES = len(IMU_COLUMNS) * len(STATISTICS)
+
+# cached fold tensors of this worker process, by cache path
+_folds = {}
+
+
+def load_fold(cache_path):
+    """
+    The cached (all-feature) tensors of a fold, read from disk once per worker process.
+    """
+    if cache_path not in _folds:
+        data = np.load(f'{cache_path}.npz')
+        _folds[cache_path] = {name: data[name] for name in data.files}
+    return _folds[cache_path]
+
+
+def unpad(padded, lengths, features=None):
+    """
+    The (length, features) sequences of padded experiments, restricted to the given feature columns.
+    """
+    if features is None:
+        return [padded[i, :length] for i, length in enumerate(lengths)]
+    return [padded[i, :length][:, features] for i, length in enumerate(lengths)]
+
+
+def experiment_mse(predictions, val_y, val_lengths):
+    return float(np.mean([np.mean((predictions[i] - val_y[i, :length, 0]) ** 2) for i, length in enumerate(val_lengths)]))
+
+
+def fit_subset(fold, cache_path, features, epochs, patience, batch_size, num_buckets, seed, model_path=None):
+    """
+    Trains the RNN on the given feature columns of a cached fold and returns (fold, features, validation MSE).
+    One Adam stage with early stopping on the validation loss, restoring the best weights, keeps candidates cheap.
+    """
+    import keras
+    from tensorflow.keras.callbacks import EarlyStopping
+    from tensorflow.keras.losses import LogCosh
+    from tensorflow.keras.optimizers import Adam
+    keras.utils.set_random_seed(seed + fold)
+
+    data = load_fold(cache_path)
+    columns = None if features is None else list(features)
+    train_batches = BucketedBatches(unpad(data['train_X'], data['train_lengths'], columns),
+                                    unpad(data['train_y'], data['train_lengths']), batch_size, num_buckets, seed=seed + fold)
+    val_X = unpad(data['val_X'], data['val_lengths'], columns)
+    val_batches = BucketedBatches(val_X, unpad(data['val_y'], data['val_lengths']), batch_size, num_buckets)
+    rnn_model = build_rnn(val_X[0].shape[1])
+    rnn_model.compile(optimizer=Adam(learning_rate=0.001), loss=LogCosh())
+    rnn_model.fit(as_keras_dataset(train_batches), epochs=epochs, validation_data=as_keras_dataset(val_batches),
+                  callbacks=[EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True)], verbose=0)
+    if model_path is not None:
+        rnn_model.save(model_path)
+    predictions = predict_bucketed(rnn_model, val_X, batch_size, num_buckets)
+    return fold, features, experiment_mse(predictions, data['val_y'], data['val_lengths'])
+
+
+def permutation_importance(fold, cache_path, model_path, features, repeats, seed):
+    """
+    Rise of the validation MSE of an all-feature fold model when each of the given features is shuffled across
+    every validation timestep, averaged over repeats. Returns (fold, {feature: importance}).
+    The padded validation tensor keeps one shape for every permutation, so the model is traced only once.
+    """
+    from tensorflow.keras.models import load_model
+    rnn_model = load_model(model_path)
+    data = load_fold(cache_path)
+    val_X, val_y, val_lengths = data['val_X'], data['val_y'], data['val_lengths']
+    valid = np.arange(val_X.shape[1]) < val_lengths[:, np.newaxis]
+
+    def mse(X):
+        predictions = rnn_model.predict_on_batch(X)[..., 0]
+        return float(np.mean([np.mean((predictions[i, :length] - val_y[i, :length, 0]) ** 2) for i, length in enumerate(val_lengths)]))
+
+    baseline = mse(val_X)
+    rng = np.random.default_rng(seed + fold)
+    importances = {}
+    permuted = val_X.copy()
+    for feature in features:
+        increases = []
+        for _ in range(repeats):
+            permuted[valid, feature] = rng.permutation(val_X[valid, feature])
+            increases.append(mse(permuted) - baseline)
+        permuted[:, :, feature] = val_X[:, :, feature]
+        importances[feature] = float(np.mean(increases))
+    return fold, importances
+
+
+def cross_validated_mse(executor, cache_paths, subsets, args):
+    """
+    Mean validation MSE over the folds of every subset (a tuple of feature indices), training all
+    (subset, fold) pairs in parallel.
+    """
+    futures = [executor.submit(fit_subset, fold, cache_path, subset, args.search_epochs, args.patience,
+                               args.batch_size, args.buckets, args.seed)
+               for subset in subsets for fold, cache_path in enumerate(cache_paths)]
+    fold_mses = {subset: [] for subset in subsets}
+    for future in as_completed(futures):
+        fold, subset, mse = future.result()
+        fold_mses[subset].append(mse)
+    return {subset: float(np.mean(mses)) for subset, mses in fold_mses.items()}
+
+
+def feature_name(index):
+    return f'{IMU_COLUMNS[index // len(STATISTICS)]} {STATISTICS[index % len(STATISTICS)]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', choices=['permutation', 'greedy'], default='greedy')
+    parser.add_argument('--size', type=int, default=13, help='number of features to select')
+    parser.add_argument('--candidates', type=int, default=30, help='greedy: most important features to choose from')
+    parser.add_argument('--features-folder', default=os.path.join(REPO_ROOT, 'Data', 'Features Data'))
+    parser.add_argument('--participants', nargs='+', default=TRAIN_PARTICIPANTS)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads-per-worker', type=int, default=1)
+    parser.add_argument('--epochs', type=int, default=200, help='epochs of the all-feature models')
+    parser.add_argument('--search-epochs', type=int, default=50, help='epochs of every greedy candidate')
+    parser.add_argument('--patience', type=int, default=20, help='early stopping patience in epochs')
+    parser.add_argument('--repeats', type=int, default=3, help='shuffles per feature for permutation importance')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--buckets', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache-folder', default=None, help='default: <features folder>/cv_cache')
+    parser.add_argument('--output-folder', default=os.path.join(REPO_ROOT, 'cv_results', 'feature_search'))
+    args = parser.parse_args()
+    cache_folder = args.cache_folder or f'{args.features_folder}/cv_cache'
+    os.makedirs(cache_folder, exist_ok=True)
+    os.makedirs(args.output_folder, exist_ok=True)
+
+    start = time.perf_counter()
+    store = FeatureStore(args.features_folder)
+    experiments = load_experiments(store, args.participants)
+    individuals = [individual for individual in args.participants if len(experiments[individual]) > 0]
+    max_seq = max(len(y) for individual in individuals for X, y in experiments[individual])
+    folds = make_folds(individuals, args.folds, args.seed)
+    all_features = list(range(NUM_FEATURES))
+    cache_paths, cache_hits = prepare_folds(store, experiments, folds, max_seq, all_features, cache_folder)
+    print(f'{len(folds)} folds over {len(individuals)} individuals with all {NUM_FEATURES} features, {cache_hits} cached, '
+          f'prepared in {time.perf_counter() - start:.2f} s; {args.workers} workers x {args.threads_per_worker} threads')
+
+    # spawn, because TensorFlow does not survive fork once it has been initialized
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_tensorflow, initargs=(args.threads_per_worker,)) as executor:
+        stage_start = time.perf_counter()
+        model_paths = [f'{args.output_folder}/all_features_fold_{fold}.keras' for fold in range(len(folds))]
+        futures = [executor.submit(fit_subset, fold, cache_path, None, args.epochs, args.patience,
+                                   args.batch_size, args.buckets, args.seed, model_paths[fold])
+                   for fold, cache_path in enumerate(cache_paths)]
+        all_feature_mse = float(np.mean([future.result()[2] for future in futures]))
+        print(f'all-feature models: MSE {all_feature_mse:.3f} in {time.perf_counter() - stage_start:.0f} s')
+
+        stage_start = time.perf_counter()
+        chunks = np.array_split(all_features, max(1, args.workers))
+        futures = [executor.submit(permutation_importance, fold, cache_path, model_paths[fold], chunk.tolist(),
+                                   args.repeats, args.seed)
+                   for fold, cache_path in enumerate(cache_paths) for chunk in chunks if len(chunk) > 0]
+        fold_importances = {feature: [] for feature in all_features}
+        for future in as_completed(futures):
+            fold, importances = future.result()
+            for feature, importance in importances.items():
+                fold_importances[feature].append(importance)
+        importance = pd.DataFrame({
+            'feature': all_features,
+            'name': [feature_name(feature) for feature in all_features],
+            'importance': [np.mean(fold_importances[feature]) for feature in all_features],
+            'importance std': [np.std(fold_importances[feature]) for feature in all_features],
+        }).sort_values('importance', ascending=False)
+        importance.to_csv(f'{args.output_folder}/permutation_importance.csv', index=False)
+        print(f'permutation importance of {NUM_FEATURES} features in {time.perf_counter() - stage_start:.0f} s')
+        print(importance.head(args.size).to_string(index=False))
+
+        ranked = importance['feature'].tolist()
+        stage_start = time.perf_counter()
+        if args.method == 'permutation':
+            selected = sorted(ranked[:args.size])
+            score = cross_validated_mse(executor, cache_paths, [tuple(selected)], args)[tuple(selected)]
+            steps = []
+        else:
+            selected, score, steps = [], np.inf, []
+            pool = ranked[:args.candidates]
+            while len(selected) < args.size:
+                subsets = [tuple(selected + [feature]) for feature in pool if feature not in selected]
+                scores = cross_validated_mse(executor, cache_paths, subsets, args)
+                best_subset = min(scores, key=scores.get)
+                if scores[best_subset] >= score:
+                    print(f'no candidate improves on MSE {score:.3f}, stopping at {len(selected)} features')
+                    break
+                selected, score = list(best_subset), scores[best_subset]
+                steps.append({'step': len(selected), 'feature': selected[-1], 'name': feature_name(selected[-1]),
+                              'mse': score, 'candidates': len(subsets)})
+                print(f'step {len(selected)}: + {feature_name(selected[-1])} ({selected[-1]}), MSE {score:.3f} '
+                      f'over {len(subsets)} candidates')
+            pd.DataFrame(steps).to_csv(f'{args.output_folder}/greedy_steps.csv', index=False)
+        print(f'{args.method} selection in {time.perf_counter() - stage_start:.0f} s')
+
+    ordered_importance = importance.set_index('feature')['importance']
+    manifest = save_feature_manifest(
+        f'{args.output_folder}/features.json', selected, IMU_COLUMNS,
+        method=args.method,
+        cv_mse=score,
+        all_features_cv_mse=all_feature_mse,
+        importance=[float(ordered_importance[feature]) for feature in selected],
+        search={'folds': folds, 'epochs': args.epochs, 'search epochs': args.search_epochs, 'patience': args.patience,
+                'repeats': args.repeats, 'candidates': args.candidates, 'seed': args.seed, 'greedy steps': steps},
+    )
+    print(f"selected {len(selected)} features, cross-validated MSE {score:.3f} (all features {all_feature_mse:.3f})")
+    print(f"wrote manifest version {manifest['version']} to {args.output_folder}/features.json in "
+          f'{time.perf_counter() - start:.0f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Length-bucketed batching for the fatigue RNN.
+
+Instead of padding every experiment to the longest sequence of the data set, experiments are sorted by length,
+split into a few buckets of similar length, and every batch is padded only to the longest experiment it holds.
+The Masking layer still hides the remaining padding, so the model is unchanged apart from accepting any length.
+"""
+import time
+import numpy as np
+
+def bucket_batches(lengths, batch_size, num_buckets=4, rng=None):
+    """
+    Index arrays of the batches: experiments sorted by length, split into num_buckets buckets of equal count,
+    and cut into batches of at most batch_size within each bucket. With an rng the experiments within each bucket
+    and the order of the batches are shuffled.
+    """
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    for bucket in np.array_split(order, max(1, min(num_buckets, len(order)))):
+        if rng is not None:
+            bucket = rng.permutation(bucket)
+        batches.extend(bucket[start:start + batch_size] for start in range(0, len(bucket), batch_size))
+    if rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+def pad_batch(sequences, length=None, value=-1):
+    """
+    Post-pads (length, ...) sequences to (len(sequences), length, ...) float32, length defaulting to the longest.
+    """
+    length = length or max(len(sequence) for sequence in sequences)
+    padded = np.full((len(sequences), length) + sequences[0].shape[1:], value, dtype='float32')
+    for i, sequence in enumerate(sequences):
+        padded[i, :len(sequence)] = sequence[:length]
+    return padded
+
+def padded_fraction(lengths, batches=None, max_seq=None):
+    """
+    Fraction of the timesteps fed to the LSTM that are padding: with every experiment padded to max_seq
+    (default the longest), or with each of the given batches padded to its own longest experiment.
+    """
+    lengths = np.asarray(lengths)
+    if batches is None:
+        total = len(lengths) * (max_seq or lengths.max())
+    else:
+        total = sum(len(batch) * lengths[batch].max() for batch in batches)
+    return 1 - lengths.sum() / total
+
+
+class BucketedBatches():
+    """
+    (X, y) batches of variable-length experiments for model.fit, reshuffled within buckets after every epoch
+    when a seed is given. y sequences are (length, 1). Use as_keras_dataset to pass it to Keras.
+    """
+    def __init__(self, X, y, batch_size=128, num_buckets=4, seed=None):
+        self.X = X
+        self.y = y
+        self.lengths = np.array([len(sequence) for sequence in X])
+        self.batch_size = batch_size
+        self.num_buckets = num_buckets
+        self.rng = None if seed is None else np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, index):
+        batch = self.batches[index]
+        return pad_batch([self.X[i] for i in batch]), pad_batch([self.y[i] for i in batch])
+
+    def on_epoch_end(self):
+        self.batches = bucket_batches(self.lengths, self.batch_size, self.num_buckets, self.rng)
+
+    def padded_fraction(self):
+        return padded_fraction(self.lengths, self.batches)
+
+
+def as_keras_dataset(batches):
+    """
+    Wraps BucketedBatches in a keras.utils.PyDataset. Keras is only imported here.
+    """
+    from keras.utils import PyDataset
+
+    class KerasBatches(PyDataset):
+        def __init__(self):
+            super().__init__()
+
+        def __len__(self):
+            return len(batches)
+
+        def __getitem__(self, index):
+            return batches[index]
+
+        def on_epoch_end(self):
+            batches.on_epoch_end()
+
+    return KerasBatches()
+
+def epoch_timer(epoch_times):
+    """
+    Keras callback appending the wall time of every epoch, in seconds, to the list epoch_times.
+    """
+    from keras.callbacks import Callback
+
+    class EpochTimer(Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.epoch_start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            epoch_times.append(time.perf_counter() - self.epoch_start)
+
+    return EpochTimer()
+
+def predict_bucketed(model, X, batch_size=128, num_buckets=4):
+    """
+    Predictions (length,) for every experiment in X from one model.predict per length-bucketed batch.
+    """
+    lengths = [len(sequence) for sequence in X]
+    predictions = [None] * len(X)
+    for batch in bucket_batches(lengths, batch_size, num_buckets):
+        batch_predictions = model.predict(pad_batch([X[i] for i in batch]), verbose=0)
+        for row, i in enumerate(batch):
+            predictions[i] = batch_predictions[row, :lengths[i], 0]
+    return predictions
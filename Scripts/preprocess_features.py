@@ -0,0 +1,137 @@
+"""
+Regenerates Data/Features Data from Data/Participants in parallel, as the last cells of preprocess_data.ipynb do.
+
+Every experiment's X.npy and y.npy are stored with the hash of its imu_data.csv, repetitions.csv and borg.csv
+together with the feature extraction parameters and the source of FeaturePlan.py and BorgLabels.py, so a run only
+recomputes experiments whose inputs or feature definitions changed. The feature store is rebuilt afterwards.
+
+    python Scripts/preprocess_features.py --workers 8
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+# one experiment per process; BLAS threads inside each worker would only compete with the other workers
+for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+    os.environ.setdefault(variable, '1')
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'System'))
+from BorgLabels import experiment_labels
+from ColumnarIMU import find_experiment_folders, read_imu_data
+from FeaturePlan import STATISTICS, extract_feature_matrices
+from FeatureStore import build_feature_store
+
+INPUT_FILES = ['imu_data.csv', 'repetitions.csv', 'borg.csv']
+SOURCE_FILES = ['FeaturePlan.py', 'BorgLabels.py']
+FEATURE_PARAMS = {
+    'statistics': STATISTICS,
+    'welch max nperseg': 256,
+    # features are divided by those of the first repetition, with zeros replaced by this value
+    'normalization zero': 1e-8,
+}
+CACHE_FILE = 'cache.json'
+
+
+def feature_definition_hash():
+    digest = hashlib.sha256(json.dumps(FEATURE_PARAMS, sort_keys=True).encode())
+    for source_file in SOURCE_FILES:
+        with open(os.path.join(REPO_ROOT, 'System', source_file), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def experiment_hash(folder_path, definition_hash):
+    digest = hashlib.sha256(definition_hash.encode())
+    for input_file in INPUT_FILES:
+        with open(f'{folder_path}/{input_file}', 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def is_cached(new_folder, key):
+    cache_path = f'{new_folder}/{CACHE_FILE}'
+    if not os.path.exists(cache_path) or not os.path.exists(f'{new_folder}/X.npy') or not os.path.exists(f'{new_folder}/y.npy'):
+        return False
+    with open(cache_path) as f:
+        return json.load(f).get('key') == key
+
+
+def process_experiment(folder_path, new_folder, key):
+    """
+    Computes and saves X.npy and y.npy of one experiment. Runs in a worker process; returns the elapsed seconds.
+    """
+    start = time.perf_counter()
+    imu_df = read_imu_data(folder_path)
+    timestamps = list(imu_df.index)
+    repetitions_df = pd.read_csv(f'{folder_path}/repetitions.csv')
+    experiment_y = experiment_labels(folder_path, timestamps, repetitions_df.values)
+    data_segments = [imu_df.loc[timestamps[start_index]:timestamps[end_index]].values
+                     for start_index, end_index in repetitions_df.values]
+    experiment_X = extract_feature_matrices(data_segments)
+    if len(experiment_X) > 0:
+        normalization_matrix = np.where(experiment_X[0] == 0, FEATURE_PARAMS['normalization zero'], experiment_X[0])
+        experiment_X = experiment_X / normalization_matrix
+
+    os.makedirs(new_folder, exist_ok=True)
+    np.save(f'{new_folder}/X.npy', np.array(experiment_X))
+    np.save(f'{new_folder}/y.npy', np.array(experiment_y))
+    # written last, so an interrupted experiment is recomputed on the next run
+    with open(f'{new_folder}/{CACHE_FILE}', 'w') as f:
+        json.dump({'key': key, 'inputs': INPUT_FILES, 'repetitions': len(experiment_y)}, f)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--participants-folder', default=os.path.join(REPO_ROOT, 'Data', 'Participants'))
+    parser.add_argument('--features-folder', default=os.path.join(REPO_ROOT, 'Data', 'Features Data'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true', help='recompute every experiment')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    definition_hash = feature_definition_hash()
+    stale = []
+    num_cached = 0
+    for folder_path in find_experiment_folders(args.participants_folder):
+        if not all(os.path.exists(f'{folder_path}/{input_file}') for input_file in INPUT_FILES):
+            continue
+        experiment = os.path.relpath(folder_path, args.participants_folder)
+        new_folder = f'{args.features_folder}/{experiment}'
+        key = experiment_hash(folder_path, definition_hash)
+        if not args.force and is_cached(new_folder, key):
+            num_cached += 1
+        else:
+            stale.append((experiment, folder_path, new_folder, key))
+    hash_time = time.perf_counter() - start
+    print(f'{num_cached} experiments up to date, {len(stale)} to compute (hashing took {hash_time:.2f} s)')
+
+    experiment_times = []
+    if stale:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(process_experiment, folder_path, new_folder, key): experiment
+                       for experiment, folder_path, new_folder, key in stale}
+            for future in as_completed(futures):
+                elapsed = future.result()
+                experiment_times.append(elapsed)
+                print(f'{futures[future]}: {elapsed:.2f} s')
+        build_feature_store(args.features_folder)
+
+    total = time.perf_counter() - start
+    print(f'cache hits {num_cached}, misses {len(stale)} ({num_cached / max(num_cached + len(stale), 1):.0%} hit rate)')
+    if experiment_times:
+        print(f'per experiment: mean {np.mean(experiment_times):.2f} s, max {np.max(experiment_times):.2f} s, '
+              f'{np.sum(experiment_times):.1f} s of work in {total:.1f} s wall time with {args.workers} workers')
+    else:
+        print(f'nothing to compute, {total:.2f} s wall time')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Scores the saved RNN on every experiment of Data/Features Data in a few batched forward passes.
+
+The LSTM is causal, so one pass over an experiment's whole sequence gives the prediction after every repetition,
+which inference_example.ipynb obtains by predicting on every growing prefix. Experiments are batched in length
+buckets (length_buckets.py), so the whole corpus takes one predict per bucket.
+
+Writes predictions/<individual>/<experiment>.npy (one prediction per repetition) and summary.csv with the MSE of
+every experiment, over all repetitions and up to the first Borg value of 7 as in train_rnn.ipynb.
+--check N also runs the prefix loop of inference_example.ipynb on the first N experiments and compares.
+
+    python Scripts/score_features.py --backend numpy
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import joblib
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'System'))
+from FeaturePlan import FeaturePlan
+from FeatureStore import FeatureStore
+from ModelLoader import load_rnn_model, load_model_features
+from cross_validate import FATIGUE_THRESHOLD, TRAIN_PARTICIPANTS
+from length_buckets import predict_bucketed
+
+
+def prefix_predictions(rnn_model, X):
+    """
+    The prediction after every repetition from one predict per growing prefix, as in inference_example.ipynb.
+    """
+    return np.array([np.squeeze(rnn_model.predict(X[np.newaxis, :end], verbose=0)).reshape(-1)[-1]
+                     for end in range(1, len(X) + 1)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--features-folder', default=os.path.join(REPO_ROOT, 'Data', 'Features Data'))
+    parser.add_argument('--model-folder', default=os.path.join(REPO_ROOT, 'System', 'models'))
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='keras')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--buckets', type=int, default=4)
+    parser.add_argument('--include-skipped', action='store_true', help='also score the experiments without the 3 kg weights')
+    parser.add_argument('--check', type=int, default=0, help='compare with the prefix loop on the first N experiments')
+    parser.add_argument('--output-folder', default=os.path.join(REPO_ROOT, 'inference_results'))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rnn_model = load_rnn_model(args.model_folder, args.backend)
+    scaler = joblib.load(f'{args.model_folder}/scaler.pkl')
+    rnn_indices = load_model_features(args.model_folder, rnn_model)['feature_indices']
+    scaler_mean, scaler_scale = FeaturePlan(rnn_indices).restrict_scaler(scaler)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = FeatureStore(args.features_folder)
+    rows = store.rows(include_skipped=args.include_skipped)
+    X, y = [], []
+    for row in rows:
+        experiment_X, experiment_y = store.experiment(row)
+        # same arithmetic as scaler.transform followed by selecting rnn_indices
+        X.append(((experiment_X[:, rnn_indices] - scaler_mean) / scaler_scale).astype('float32'))
+        y.append(np.asarray(experiment_y, dtype=float))
+    prepare_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = predict_bucketed(rnn_model, X, args.batch_size, args.buckets)
+    predict_time = time.perf_counter() - start
+
+    results = []
+    for row, experiment_y, prediction in zip(rows, y, predictions):
+        individual, experiment = str(store.index['individual'][row]), str(store.index['experiment'][row])
+        os.makedirs(f'{args.output_folder}/predictions/{individual}', exist_ok=True)
+        np.save(f'{args.output_folder}/predictions/{individual}/{experiment}.npy', prediction)
+        # repetitions before the first Borg value >= 7, the part train_rnn.ipynb trains and tests on
+        below = np.argmax(experiment_y >= FATIGUE_THRESHOLD) if np.any(experiment_y >= FATIGUE_THRESHOLD) else len(experiment_y)
+        results.append({
+            'individual': individual,
+            'experiment': experiment,
+            'split': 'train' if individual in TRAIN_PARTICIPANTS else 'test',
+            'repetitions': len(experiment_y),
+            'mse': float(np.mean((prediction - experiment_y) ** 2)),
+            f'mse below {FATIGUE_THRESHOLD}': float(np.mean((prediction[:below] - experiment_y[:below]) ** 2)) if below > 0 else np.nan,
+            'final prediction': float(prediction[-1]),
+            'final borg': float(experiment_y[-1]),
+        })
+    summary = pd.DataFrame(results)
+    summary.to_csv(f'{args.output_folder}/summary.csv', index=False)
+
+    below_column = f'mse below {FATIGUE_THRESHOLD}'
+    print(summary.groupby('split')[['mse', below_column]].agg(['mean', 'std', 'count']).to_string())
+    print(f'{len(rows)} experiments, {sum(len(experiment_y) for experiment_y in y)} repetitions ({args.backend} backend): '
+          f'model load {load_time:.2f} s, features {prepare_time:.2f} s, predict {predict_time:.2f} s')
+    print(f'wrote summary.csv and predictions/ to {args.output_folder}')
+
+    if args.check:
+        start = time.perf_counter()
+        max_error = max(float(np.max(np.abs(prefix_predictions(rnn_model, X[i]) - predictions[i])))
+                        for i in range(min(args.check, len(X))))
+        check_time = time.perf_counter() - start
+        print(f'prefix loop on {min(args.check, len(X))} experiments: {check_time:.2f} s, '
+              f'max abs difference from the batched pass {max_error:.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+def read_borg(folder_path):
+    """
+    Borg ratings of an experiment as (milliseconds since the first rating, rating), as get_borg_df reads borg.csv.
+    """
+    df = pd.read_csv(folder_path + '/borg.csv', index_col=0, parse_dates=True)
+    min_time = df.index.min()
+    times_ms = ((df.index - min_time).total_seconds() * 1000).values
+    return np.asarray(times_ms, dtype=float), df['fatigue'].values.astype(float)
+
+def interpolate_borg(borg_times_ms, borg_values, timestamps):
+    """
+    Borg value of every IMU sample, in the order of timestamps, equal to get_borg_df in preprocess_data.ipynb.
+
+    get_borg_df merges the rating times into the sorted sample times and interpolates linearly by position in
+    that merged index (pandas method='linear'), leaving samples before the first rating as NaN and holding the
+    last rating after it. Here the merged positions are computed with searchsorted and passed to one np.interp.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    order = np.argsort(timestamps, kind='stable')
+    sorted_times = timestamps[order]
+    sorted_values = _interpolate_sorted(np.asarray(borg_times_ms, dtype=float), np.asarray(borg_values, dtype=float), sorted_times)
+    values = np.empty(len(timestamps))
+    values[order] = sorted_values
+    return values
+
+def _interpolate_sorted(borg_times_ms, borg_values, sorted_times):
+    is_extra = ~np.isin(borg_times_ms, sorted_times)
+    extra_times = np.sort(borg_times_ms[is_extra])
+    # position of every sample in the merged index: its own rank plus the number of rating times before it
+    sample_positions = np.arange(len(sorted_times)) + np.searchsorted(extra_times, sorted_times, side='left')
+    borg_positions = np.where(
+        is_extra,
+        np.searchsorted(sorted_times, borg_times_ms, side='left') + np.searchsorted(extra_times, borg_times_ms, side='left'),
+        sample_positions[np.minimum(np.searchsorted(sorted_times, borg_times_ms, side='left'), len(sorted_times) - 1)])
+
+    valid = ~np.isnan(borg_values)
+    if not np.any(valid) or len(sorted_times) == 0:
+        return np.full(len(sorted_times), np.nan)
+    known = np.argsort(borg_positions[valid], kind='stable')
+    known_positions = borg_positions[valid][known]
+    known_values = borg_values[valid][known]
+    return np.interp(sample_positions, known_positions, known_values, left=np.nan)
+
+def repetition_labels(timestamps, sample_borg, intervals_ms):
+    """
+    Mean Borg value of the samples with timestamps between start_ms and end_ms inclusive for every
+    (start_ms, end_ms) in intervals_ms, ignoring NaN like borg_df.loc[start_ms : end_ms].fatigue.mean().
+    Computed from prefix sums over the samples in timestamp order, so each repetition costs O(log n).
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    order = np.argsort(timestamps, kind='stable')
+    sorted_times = timestamps[order]
+    sorted_borg = np.asarray(sample_borg, dtype=float)[order]
+    known = ~np.isnan(sorted_borg)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(known, sorted_borg, 0))))
+    counts = np.concatenate(([0], np.cumsum(known)))
+
+    intervals_ms = np.asarray(intervals_ms, dtype=float).reshape(-1, 2)
+    lower = np.searchsorted(sorted_times, intervals_ms[:, 0], side='left')
+    upper = np.maximum(np.searchsorted(sorted_times, intervals_ms[:, 1], side='right'), lower)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts[upper] > counts[lower], (sums[upper] - sums[lower]) / (counts[upper] - counts[lower]), np.nan)
+
+def experiment_labels(folder_path, timestamps, repetitions):
+    """
+    y of one experiment: the mean Borg value of every repetition, given as (start, end) sample indices.
+    """
+    borg_times_ms, borg_values = read_borg(folder_path)
+    sample_borg = interpolate_borg(borg_times_ms, borg_values, timestamps)
+    timestamps = np.asarray(timestamps, dtype=float)
+    repetitions = np.asarray(repetitions, dtype=int).reshape(-1, 2)
+    return repetition_labels(timestamps, sample_borg, timestamps[repetitions])
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+COLUMNAR_FOLDER = 'imu_data.columns'
+CHUNK_ROWS = 4096
+
+def convert_experiment(folder_path, chunk_rows=CHUNK_ROWS, level=6):
+    """
+    Converts folder_path/imu_data.csv into folder_path/imu_data.columns:
+    - timestamps.npy: the 'Timestamp (ms)' index, uncompressed so it can be memory-mapped and searched
+    - data.bin: every channel split into chunks of chunk_rows values, each byte-shuffled and zlib-compressed
+    - meta.json: column names, chunk byte ranges and the size and mtime of the source csv
+    """
+    csv_path = f'{folder_path}/imu_data.csv'
+    imu_df = pd.read_csv(csv_path, index_col=0)
+    columnar_path = f'{folder_path}/{COLUMNAR_FOLDER}'
+    os.makedirs(columnar_path, exist_ok=True)
+    timestamps = imu_df.index.values.astype('<f8')
+    np.save(f'{columnar_path}/timestamps.npy', timestamps)
+
+    chunks = {}
+    offset = 0
+    with open(f'{columnar_path}/data.bin', 'wb') as f:
+        for column in imu_df.columns:
+            values = imu_df[column].values.astype('<f8')
+            chunks[column] = []
+            for start in range(0, len(values), chunk_rows):
+                # grouping the bytes of each significance compresses slowly varying float64 signals far better
+                shuffled = values[start:start + chunk_rows].view(np.uint8).reshape(-1, 8).T.tobytes()
+                compressed = zlib.compress(shuffled, level)
+                f.write(compressed)
+                chunks[column].append([offset, len(compressed)])
+                offset += len(compressed)
+
+    stat = os.stat(csv_path)
+    meta = {
+        'index name': imu_df.index.name,
+        'columns': list(imu_df.columns),
+        'num rows': len(imu_df),
+        # host timestamps occasionally step backwards; .loc then slices between the exact labels
+        'monotonic': bool(np.all(np.diff(timestamps) > 0)),
+        'chunk rows': chunk_rows,
+        'dtype': '<f8',
+        'chunks': chunks,
+        'source size': stat.st_size,
+        'source mtime ns': stat.st_mtime_ns,
+    }
+    # written last, so an interrupted conversion is detected as missing
+    with open(f'{columnar_path}/meta.json', 'w') as f:
+        json.dump(meta, f)
+    return columnar_path
+
+def is_converted(folder_path):
+    """
+    Whether imu_data.columns exists and was converted from the current imu_data.csv (or the csv is gone).
+    """
+    meta_path = f'{folder_path}/{COLUMNAR_FOLDER}/meta.json'
+    if not os.path.exists(meta_path):
+        return False
+    csv_path = f'{folder_path}/imu_data.csv'
+    if not os.path.exists(csv_path):
+        return True
+    with open(meta_path) as f:
+        meta = json.load(f)
+    stat = os.stat(csv_path)
+    return meta['source size'] == stat.st_size and meta['source mtime ns'] == stat.st_mtime_ns
+
+def read_imu_data(folder_path, columns=None):
+    """
+    imu_data.csv of an experiment as the DataFrame pd.read_csv(..., index_col=0) gives, restricted to `columns`.
+    Reads through imu_data.columns when it is up to date and falls back to the csv otherwise.
+    """
+    if is_converted(folder_path):
+        imu = ColumnarIMU(folder_path)
+        imu_df = imu.to_frame(columns)
+        imu.close()
+        return imu_df
+    imu_df = pd.read_csv(f'{folder_path}/imu_data.csv', index_col=0)
+    return imu_df if columns is None else imu_df[columns]
+
+
+class ColumnarIMU():
+    """
+    Reader for an experiment converted by convert_experiment. Only the chunks of the requested channels that
+    overlap the requested rows are read and decompressed, and the most recent cache_chunks of them are kept,
+    so consecutive repetitions mostly hit chunks that are already decompressed.
+    """
+    def __init__(self, folder_path, cache_chunks=256):
+        self.columnar_path = f'{folder_path}/{COLUMNAR_FOLDER}'
+        with open(f'{self.columnar_path}/meta.json') as f:
+            self.meta = json.load(f)
+        self.columns = self.meta['columns']
+        self.index_name = self.meta['index name']
+        self.chunk_rows = self.meta['chunk rows']
+        self.timestamps = np.load(f'{self.columnar_path}/timestamps.npy', mmap_mode='r')
+        self.data_file = open(f'{self.columnar_path}/data.bin', 'rb')
+        self.label_positions = None
+        self.cache_chunks = cache_chunks
+        self.chunk_cache = OrderedDict()
+
+    def __len__(self):
+        return self.meta['num rows']
+
+    def close(self):
+        self.data_file.close()
+
+    def read(self, columns=None, start=0, stop=None):
+        """
+        Rows start to stop (exclusive, by position) of the given channels as an array (rows, channels).
+        """
+        columns = self.columns if columns is None else list(columns)
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(start, 0)
+        values = np.empty((max(stop - start, 0), len(columns)))
+        if stop <= start:
+            return values
+        first_chunk, last_chunk = start // self.chunk_rows, (stop - 1) // self.chunk_rows
+        for column_index, column in enumerate(columns):
+            chunks = self.meta['chunks'][column]
+            for chunk in range(first_chunk, last_chunk + 1):
+                chunk_start = chunk * self.chunk_rows
+                chunk_values = self._read_chunk(column, chunk, *chunks[chunk])
+                lower = max(start, chunk_start) - chunk_start
+                upper = min(stop, chunk_start + len(chunk_values)) - chunk_start
+                values[chunk_start + lower - start:chunk_start + upper - start, column_index] = chunk_values[lower:upper]
+        return values
+
+    def positions(self, start_ms, end_ms):
+        """
+        Positional row range [start, stop) that imu_df.loc[start_ms : end_ms] selects: every timestamp between the two
+        for a sorted index, and the rows between the two exact labels otherwise.
+        """
+        if self.meta['monotonic']:
+            return np.searchsorted(self.timestamps, start_ms, side='left'), np.searchsorted(self.timestamps, end_ms, side='right')
+        if self.label_positions is None:
+            self.label_positions = {timestamp: position for position, timestamp in enumerate(self.timestamps.tolist())}
+        try:
+            return self.label_positions[start_ms], self.label_positions[end_ms] + 1
+        except KeyError as error:
+            raise KeyError(f'{error.args[0]} is not a timestamp of this unsorted recording') from None
+
+    def loc(self, start_ms, end_ms, columns=None):
+        """
+        Same values as imu_df.loc[start_ms : end_ms, columns].values.
+        """
+        start, stop = self.positions(start_ms, end_ms)
+        return self.read(columns, start, stop)
+
+    def to_frame(self, columns=None):
+        columns = self.columns if columns is None else list(columns)
+        index = pd.Index(np.array(self.timestamps), name=self.index_name)
+        return pd.DataFrame(self.read(columns), index=index, columns=columns)
+
+    def _read_chunk(self, column, chunk, offset, length):
+        key = (column, chunk)
+        if key in self.chunk_cache:
+            self.chunk_cache.move_to_end(key)
+            return self.chunk_cache[key]
+        self.data_file.seek(offset)
+        shuffled = np.frombuffer(zlib.decompress(self.data_file.read(length)), dtype=np.uint8)
+        values = np.ascontiguousarray(shuffled.reshape(8, -1).T).view(self.meta['dtype']).ravel()
+        self.chunk_cache[key] = values
+        if len(self.chunk_cache) > self.cache_chunks:
+            self.chunk_cache.popitem(last=False)
+        return values
+
+def find_experiment_folders(participants_folder):
+    folders = []
+    for individual_folder in sorted(os.listdir(participants_folder)):
+        if 'individual' not in individual_folder:
+            continue
+        for experiment_folder in sorted(os.listdir(f'{participants_folder}/{individual_folder}')):
+            folder_path = f'{participants_folder}/{individual_folder}/{experiment_folder}'
+            if 'experiment' in experiment_folder and os.path.exists(f'{folder_path}/imu_data.csv'):
+                folders.append(folder_path)
+    return folders
+
+def convert_all(participants_folder):
+    converted = 0
+    for folder_path in find_experiment_folders(participants_folder):
+        if not is_converted(folder_path):
+            convert_experiment(folder_path)
+            converted += 1
+    print(f'Converted {converted} experiments in {participants_folder}')
+
+def benchmark(participants_folder, limit=None):
+    """
+    Compares pd.read_csv with the columnar reader: loading whole experiments, and reading the repetitions of each
+    experiment by timestamp as preprocess_data.ipynb does.
+    """
+    folders = [folder for folder in find_experiment_folders(participants_folder) if is_converted(folder)][:limit]
+    csv_load = csv_repetitions = columnar_load = columnar_repetitions = 0
+    csv_bytes = columnar_bytes = 0
+    for folder_path in folders:
+        start = time.perf_counter()
+        imu_df = pd.read_csv(f'{folder_path}/imu_data.csv', index_col=0)
+        csv_load += time.perf_counter() - start
+        timestamps = list(imu_df.index)
+        repetitions = pd.read_csv(f'{folder_path}/repetitions.csv').values
+        start = time.perf_counter()
+        expected = [imu_df.loc[timestamps[s]:timestamps[e]].values for s, e in repetitions]
+        csv_repetitions += time.perf_counter() - start
+
+        start = time.perf_counter()
+        read_imu_data(folder_path)
+        columnar_load += time.perf_counter() - start
+        start = time.perf_counter()
+        imu = ColumnarIMU(folder_path)
+        segments = [imu.loc(imu.timestamps[s], imu.timestamps[e]) for s, e in repetitions]
+        imu.close()
+        columnar_repetitions += time.perf_counter() - start
+        if not all(np.array_equal(a, b, equal_nan=True) for a, b in zip(expected, segments)):
+            raise ValueError(f'{folder_path}: columnar data differs from imu_data.csv')
+
+        csv_bytes += os.path.getsize(f'{folder_path}/imu_data.csv')
+        columnar_path = f'{folder_path}/{COLUMNAR_FOLDER}'
+        columnar_bytes += sum(os.path.getsize(f'{columnar_path}/{name}') for name in os.listdir(columnar_path))
+
+    print(f'{len(folders)} experiments, csv {csv_bytes / 2**20:.0f} MB, columnar {columnar_bytes / 2**20:.0f} MB')
+    print(f'whole experiments:    read_csv {csv_load:.2f} s, columnar {columnar_load:.2f} s ({csv_load / columnar_load:.1f}x)')
+    print(f'repetitions by time:  read_csv + loc {csv_load + csv_repetitions:.2f} s, columnar loc {columnar_repetitions:.2f} s '
+          f'({(csv_load + csv_repetitions) / columnar_repetitions:.1f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts Data/Participants imu_data.csv files to a compressed columnar format')
+    parser.add_argument('command', choices=['convert', 'benchmark'])
+    parser.add_argument('--participants-folder', default='./Data/Participants')
+    parser.add_argument('--limit', type=int, default=None, help='only benchmark the first N experiments')
+    args = parser.parse_args()
+    if args.command == 'convert':
+        convert_all(args.participants_folder)
+    else:
+        benchmark(args.participants_folder, args.limit)
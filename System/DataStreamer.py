@@ -2,60 +2,114 @@ import pandas as pd
 from collections import defaultdict
 import math
 import numpy as np
-from scipy.signal import welch, find_peaks
-from scipy.stats import skew, kurtosis
-from scipy.fft import fft
 import joblib
-from datetime import datetime
-import os
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-import tensorflow as tf
-from tensorflow.keras.models import load_model
+import time
+import queue
+import threading
+from IncrementalRNN import IncrementalRNN
+from ModelLoader import load_rnn_model, load_model_features
+from FeaturePlan import FeaturePlan, IMU_COLUMNS
+from FeatureSequence import FeatureSequence
+from SampleBuffer import SampleBuffer
+from StreamAligner import StreamAligner
+from SessionRecorder import SessionRecorder
+from PrefixStats import PrefixStats
+
+# host time of each aligned row, on the wrist device clock mapped to time.time(), stored after the channels
+TIME_COLUMN = 'Host Time (s)'
+# channels carried by each xIMU stream, which StreamAligner merges into one row per 20 ms
+STREAM_COLUMNS = {
+    'euler_wrist': ['Wrist Roll (deg)', 'Wrist Pitch (deg)', 'Wrist Yaw (deg)'],
+    'euler_arm': ['Arm Roll (deg)', 'Arm Pitch (deg)', 'Arm Yaw (deg)'],
+    'inertial_wrist': ['Wrist Gyroscope X (deg/s)', 'Wrist Gyroscope Y (deg/s)', 'Wrist Gyroscope Z (deg/s)',
+                       'Wrist Accelerometer X (g)', 'Wrist Accelerometer Y (g)', 'Wrist Accelerometer Z (g)'],
+    'inertial_arm': ['Arm Gyroscope X (deg/s)', 'Arm Gyroscope Y (deg/s)', 'Arm Gyroscope Z (deg/s)',
+                     'Arm Accelerometer X (g)', 'Arm Accelerometer Y (g)', 'Arm Accelerometer Z (g)'],
+}
+STREAM_DEVICES = {'euler_wrist': 'wrist', 'euler_arm': 'arm', 'inertial_wrist': 'wrist', 'inertial_arm': 'arm'}
+STREAM_INDICES = {stream: [IMU_COLUMNS.index(column) for column in columns] for stream, columns in STREAM_COLUMNS.items()}
+# (vector columns, magnitude column) of the gyroscope and accelerometer of each device
+MAGNITUDES = [([IMU_COLUMNS.index(f'{device} {sensor} {axis} ({unit})') for axis in 'XYZ'],
+               IMU_COLUMNS.index(f'{device} {sensor} Magnitude ({unit})'))
+              for device in ['Wrist', 'Arm'] for sensor, unit in [('Gyroscope', 'deg/s'), ('Accelerometer', 'g')]]
+WRIST_EULER = [IMU_COLUMNS.index(f'Wrist {angle} (deg)') for angle in ['Roll', 'Pitch', 'Yaw']]
+ARM_EULER = [IMU_COLUMNS.index(f'Arm {angle} (deg)') for angle in ['Roll', 'Pitch', 'Yaw']]
+DIFFERENCE_EULER = [IMU_COLUMNS.index(f'Difference {angle} (deg)') for angle in ['Roll', 'Pitch', 'Yaw']]
+DIFFERENCE_PITCH = IMU_COLUMNS.index('Difference Pitch (deg)')
+
+class StreamerEvent():
+    """
+    Snapshot published by DataStreamer to its subscribers. kind is 'peak' when a new peak was found and
+    'prediction' when a repetition was scored; the other fields hold the state after that event, so a
+    subscriber only ever needs the newest one.
+    """
+    __slots__ = ('kind', 'num_peaks', 'num_repetitions', 'prediction', 'fatigue', 'time')
+
+    def __init__(self, kind, num_peaks, num_repetitions, prediction, fatigue):
+        self.kind = kind
+        self.num_peaks = num_peaks
+        self.num_repetitions = num_repetitions
+        self.prediction = prediction
+        self.fatigue = fatigue
+        self.time = time.perf_counter()
+
 
 class DataStreamer():
-    def __init__(self, wrist_connection, arm_connection):
-        model_folder = './System/models'
-        self.rnn_model = load_model(f'{model_folder}/rnn.keras')
-        self.rnn_indices = [9, 12, 13, 18, 32, 73, 75, 114, 118, 156, 205, 225, 262]
-        self.scaler = joblib.load(f'{model_folder}/scaler.pkl')
+    def __init__(self, wrist_connection, arm_connection, incremental=True, backend='keras', queue_size=10000,
+                 folder_path=None, chunk_rows=250, model_folder='./System/models', feature_engine='direct',
+                 model_loader=None, step_scheduler=None, pitch_trace=None, alignment_delay_ms=200,
+                 replay_clock=False):
+        # a ModelLoader started at app launch has usually finished loading and warming up the models by now
+        if model_loader is not None:
+            self.rnn_model, self.scaler, self.feature_manifest = model_loader.get()
+        else:
+            self.rnn_model = load_rnn_model(model_folder, backend)
+            self.scaler = joblib.load(f'{model_folder}/scaler.pkl')
+            self.feature_manifest = load_model_features(model_folder, self.rnn_model)
+        # the features the model was trained on, from the models/features.json saved with it
+        self.rnn_indices = self.feature_manifest['feature_indices']
+        # when incremental, the LSTM state is carried between repetitions instead of replaying the whole session
+        self.incremental = incremental
+        # a StepScheduler shared by concurrent sessions batches their LSTM steps into one call
+        self.step_scheduler = step_scheduler
+        self.rnn_stepper = IncrementalRNN(self.rnn_model) if step_scheduler is None else step_scheduler.session()
+        # only the features consumed by the RNN are computed, normalized and scaled online
+        self.feature_plan = FeaturePlan(self.rnn_indices)
+        self.scaler_mean, self.scaler_scale = self.feature_plan.restrict_scaler(self.scaler)
+        # 'prefix' takes the moment statistics from running sums instead of recomputing them over every segment
+        self.prefix_stats = None
+        if feature_engine == 'prefix':
+            # window of 5 samples, as in smoothen
+            self.prefix_stats = PrefixStats(len(self.feature_plan.channels), window=5)
+        elif feature_engine != 'direct':
+            raise ValueError(f'Unknown feature engine {feature_engine}. Must be direct or prefix')
 
         self.wrist_connection = wrist_connection
         self.arm_connection = arm_connection
 
-        self.timestamps = []
-        self.data = defaultdict(lambda: {
-            'Wrist Gyroscope X (deg/s)': None,
-            'Wrist Gyroscope Y (deg/s)': None,
-            'Wrist Gyroscope Z (deg/s)': None,
-            'Wrist Accelerometer X (g)': None,
-            'Wrist Accelerometer Y (g)': None,
-            'Wrist Accelerometer Z (g)': None,
-            'Wrist Roll (deg)': None,
-            'Wrist Pitch (deg)': None,
-            'Wrist Yaw (deg)': None,
-            'Arm Gyroscope X (deg/s)': None,
-            'Arm Gyroscope Y (deg/s)': None,
-            'Arm Gyroscope Z (deg/s)': None,
-            'Arm Accelerometer X (g)': None,
-            'Arm Accelerometer Y (g)': None,
-            'Arm Accelerometer Z (g)': None,
-            'Arm Roll (deg)': None,
-            'Arm Pitch (deg)': None,
-            'Arm Yaw (deg)': None,
-            'Wrist Gyroscope Magnitude (deg/s)': None,
-            'Wrist Accelerometer Magnitude (g)': None,
-            'Arm Gyroscope Magnitude (deg/s)': None,
-            'Arm Accelerometer Magnitude (g)': None,
-        })
-
-        self.euler_wrist_i = 0
-        self.euler_arm_i = 0
-        self.inertial_wrist_i = 0
-        self.inertial_arm_i = 0
-
-        self.roll_data = []
-        self.pitch_data = []
-        self.yaw_data = []
+        # the four xIMU streams are merged by their device timestamps onto a 20 ms grid; a lost or late packet
+        # on one stream is interpolated over (or flagged as a gap) instead of shifting the other streams.
+        # alignment_delay_ms bounds the wait for a stalled stream. replay_clock is for recordings replayed off real
+        # time, whose timestamps share one clock and whose arrival times mean nothing
+        self.aligner = StreamAligner({stream: len(columns) for stream, columns in STREAM_COLUMNS.items()}, STREAM_DEVICES,
+                                     'wrist', period_ms=20, max_delay_ms=None if replay_clock else alignment_delay_ms,
+                                     angle_columns={'euler_wrist': [0, 1, 2], 'euler_arm': [0, 1, 2]},
+                                     shared_clock=replay_clock)
+        # [start, end] row ranges where a stream was held or interpolated across a gap, or whose repetition had
+        # non-finite features, saved as gaps.csv
+        self.gaps = []
+        self.num_recorded_gaps = 0
+
+        # one aligned row per 20 ms, one column per channel
+        self.samples = SampleBuffer(IMU_COLUMNS + [TIME_COLUMN], {'aligned': IMU_COLUMNS + [TIME_COLUMN]})
+        self.num_differences = 0
+
+        # with a folder, complete rows are streamed to disk in chunks and dropped from memory once no segment needs them
+        self.recorder = None
+        if folder_path is not None:
+            self.recorder = SessionRecorder(folder_path, IMU_COLUMNS + [TIME_COLUMN], TIME_COLUMN)
+        self.chunk_rows = chunk_rows
+        self.num_recorded = 0
 
         self.intervals = []
         self.peak_pitch_min = 60
@@ -63,110 +117,221 @@ class DataStreamer():
 
         self.fatigue = 'None'
         self.all_fatigue = []
+        # called with a StreamerEvent on the worker thread after every new peak and prediction
+        self.subscribers = []
+        # a PitchTrace the live plot reads the pitch, peaks and repetitions from
+        self.pitch_trace = pitch_trace
+
+        # scaled feature vector of every repetition; normalization and scaler fold into one multiply-add per repetition
+        self.feature_sequence = FeatureSequence(self.scaler_mean, self.scaler_scale)
+
+        # the xIMU callbacks only enqueue raw samples; a worker thread does everything else
+        self.sample_queue = queue.Queue(maxsize=queue_size)
+        self.dropped_samples = {'euler_wrist': 0, 'euler_arm': 0, 'inertial_wrist': 0, 'inertial_arm': 0}
+        self.processed_samples = 0
+        self.max_queue_depth = 0
+        self.current_arrival_time = None
+        # seconds spent per repetition in each stage of the online pipeline
+        self.stage_times = defaultdict(list)
+        self.worker = threading.Thread(target=self._process_samples, daemon=True)
 
-        self.normalization_matrix = None
-        self.data_segments = []
-        
         self.start()
 
     def start(self):
+        self.worker.start()
         self.wrist_connection.add_euler_angles_callback(self.euler_callback_wrist)
         self.arm_connection.add_euler_angles_callback(self.euler_callback_arm)
         self.wrist_connection.add_inertial_callback(self.inertial_callback_wrist)
         self.arm_connection.add_inertial_callback(self.inertial_callback_arm)
         print('xIMU successfully started streaming')
 
-    def trim(self, cutoff, target_data):
-        if cutoff < len(target_data):
-            return target_data[:cutoff]
-        if cutoff > len(target_data):
-            return self.padded(target_data, cutoff)
-        return target_data
-
-    def padded(self, target_data, cutoff):
-        padded_data = np.full(cutoff, np.nan)
-        padded_data[:len(target_data)] = target_data
-        return padded_data
-    
+    def stop(self):
+        """
+        Lets the worker thread finish the samples already queued, then stops it.
+        """
+        if self.worker.is_alive():
+            self.sample_queue.put((None, None, None, None, None))
+            self.worker.join()
+        if self.step_scheduler is not None:
+            self.rnn_stepper.close()
+        print(f'xIMU pipeline stopped: {self.pipeline_stats()}')
+
     def end(self, folder_path):
-        data_df = pd.DataFrame(self.data)
-        data_df = data_df.transpose()
-        cutoff = min(len(self.timestamps), len(data_df.index))
-        data_df = data_df.iloc[:cutoff]
-
-        data_df['Difference Roll (deg)'] = self.trim(cutoff, self.roll_data)
-        data_df['Difference Pitch (deg)'] = self.trim(cutoff, self.pitch_data)
-        data_df['Difference Yaw (deg)'] = self.trim(cutoff, self.yaw_data)
-        data_df.index = self.trim(cutoff, self.timestamps)
-
-        min_time = data_df.index.min()
-        data_df.index = ((data_df.index - min_time).total_seconds() * 1000).rename('Timestamp (ms)')
+        self.stop()
+        if self.recorder is not None:
+            # the recorder already holds the session; it writes the final files on its own thread
+            self._record(final=True)
+            self._record_gaps(final=True)
+            self.recorder.close()
+            return
+        num_rows = len(self.samples)
+        data_df = pd.DataFrame(self.samples.rows(0, num_rows)[:, :len(IMU_COLUMNS)], columns=IMU_COLUMNS)
+        host_times = self.samples.column(self.samples.column_index[TIME_COLUMN], 0, num_rows)
+        data_df.index = pd.Index((host_times - np.nanmin(host_times)) * 1000, name='Timestamp (ms)')
         data_df.dropna(inplace=True)
         data_df.to_csv(f"{folder_path}/imu_data.csv", index=True)
                         
         repetitions_df = pd.DataFrame(self.intervals, columns=['start (index)', 'end (index)'])
         repetitions_df.to_csv(f"{folder_path}/repetitions.csv", index=False)
-        print(len(self.data_segments))
+        gaps_df = pd.DataFrame(self.gaps, columns=['start (index)', 'end (index)'])
+        gaps_df.to_csv(f"{folder_path}/gaps.csv", index=False)
+        print(len(self.feature_sequence))
         print('IMU data has been saved')
 
         np.save(f'{folder_path}/rnn_predictions.npy', np.array(self.all_fatigue))
 
-    
-    def _update_data(self, key, column, value):
-        self.data[key][column] = value
-
-    def _update_diff(self, key, type):
-        if type == 'pitch':
-            self.pitch_data.append(self.data[key]['Arm Pitch (deg)'] - self.data[key]['Wrist Pitch (deg)'])
+    def _record(self, final=False):
+        """
+        Hands every chunk of complete rows to the recorder, then discards the rows that are on disk and
+        that no future segment or peak check can reach.
+        """
+        num_complete = self.samples.complete_rows()
+        if num_complete - self.num_recorded < self.chunk_rows and not final:
+            return
+        self.recorder.append_rows(self.samples.rows(self.num_recorded, num_complete))
+        self.num_recorded = num_complete
+        self.samples.discard_before(min(self.num_recorded, self._first_needed_row()))
+
+    def _first_needed_row(self):
+        if len(self.peaks) >= 2:
+            return self.peaks[-2]
+        if len(self.peaks) == 1:
+            return self.peaks[0]
+        return max(0, self.num_differences - 3)
+
+    @property
+    def pitch_data(self):
+        """
+        Arm minus wrist pitch of the samples held in memory where both euler angles have arrived.
+        With a recorder, rows before self.samples.offset have already been discarded.
+        """
+        return self.samples.column(DIFFERENCE_PITCH, self.samples.offset, self.num_differences)
+
+    def _update_differences(self):
+        """
+        Fills the arm minus wrist euler differences of every new aligned row, checking for a new peak after each one.
+        """
+        while self.num_differences < len(self.samples):
+            row = self.samples.rows(self.num_differences, self.num_differences + 1)[0]
+            row[DIFFERENCE_EULER] = row[ARM_EULER] - row[WRIST_EULER]
+            if self.pitch_trace is not None:
+                self.pitch_trace.append(self.num_differences, row[DIFFERENCE_PITCH])
+            self.num_differences += 1
             self._compute_peaks()
-        if type == 'roll':
-            self.roll_data.append(self.data[key]['Arm Roll (deg)'] - self.data[key]['Wrist Roll (deg)'])
-        if type == 'yaw':
-            self.yaw_data.append(self.data[key]['Arm Yaw (deg)'] - self.data[key]['Wrist Yaw (deg)'])
-        
+
     def _calculate_magnitude(self, x, y, z):
         return math.sqrt(x**2 + y**2 + z**2)
 
     def _compute_peaks(self):
-        n = len(self.pitch_data)
+        n = self.num_differences
         if n <= 2:
             return
-        if self.pitch_data[-2] > self.pitch_data[-3] and self.pitch_data[-2] > self.pitch_data[-1]:
-            if self.pitch_data[-2] > self.peak_pitch_min:
+        pitch_data = self.pitch_data
+        offset = self.samples.offset
+        if pitch_data[-2] > pitch_data[-3] and pitch_data[-2] > pitch_data[-1]:
+            if pitch_data[-2] > self.peak_pitch_min:
                 current_peak = n - 2
-                if len(self.peaks) > 0 and self.pitch_data[(self.peaks[-1] + current_peak) // 2] > self.peak_pitch_min:
+                if len(self.peaks) > 0 and pitch_data[(self.peaks[-1] + current_peak) // 2 - offset] > self.peak_pitch_min:
                     current_peak = (self.peaks[-1] + current_peak) // 2
                     self.peaks[-1] = current_peak
+                    if self.pitch_trace is not None:
+                        self.pitch_trace.add_peak(current_peak, replace_last=True)
                 else:
                     self.peaks.append(current_peak)
+                    if self.pitch_trace is not None:
+                        self.pitch_trace.add_peak(current_peak)
+                    self._publish('peak')
                     if len(self.peaks) >= 3:
                         start_point = self.peaks[-3]
                         end_point = self.peaks[-1]
 
+                        stage_start = time.perf_counter()
+                        if self.prefix_stats is None:
+                            channels = self.feature_plan.channels
+                        else:
+                            self._extend_prefix_stats(start_point, end_point)
+                            channels = self.feature_plan.spectral_channels
+                        data_segment = self.get_segment(start_point, end_point)
+                        self._time_stage('segment assembly', stage_start)
+
+                        stage_start = time.perf_counter()
+                        # the only copy of the segment: the needed channels are gathered as smoothen's input
+                        data_segment = self.smoothen(data_segment, channels=channels)
+                        self._time_stage('smoothen', stage_start)
+
+                        stage_start = time.perf_counter()
+                        if self.prefix_stats is None:
+                            feature_matrix = self.feature_plan.compute(data_segment)
+                        else:
+                            moments = self.prefix_stats.moments(start_point, end_point)
+                            feature_matrix = self.feature_plan.compute_from_moments(moments, data_segment)
+                        self._time_stage('feature extraction', stage_start)
+
+                        if not np.isfinite(feature_matrix).all():
+                            # one non-finite step would turn the LSTM state, and every later prediction, into NaN
+                            self._add_gap(start_point, end_point)
+                            return
                         self.intervals.append((start_point, end_point))
+                        if self.pitch_trace is not None:
+                            self.pitch_trace.add_repetition(start_point, end_point)
 
+                        stage_start = time.perf_counter()
+                        # the first repetition fixes the normalization matrix
+                        self.feature_sequence.append(feature_matrix)
+                        self._time_stage('scaling', stage_start)
 
-                        remaining_data = np.array([list(self.data[key].values()) for key in range(start_point, end_point+1)])
-                        roll_data = np.array([self.roll_data[key] for key in range(start_point, end_point+1)]).reshape(-1, 1)
-                        pitch_data = np.array([self.pitch_data[key] for key in range(start_point, end_point+1)]).reshape(-1, 1)
-                        yaw_data = np.array([self.yaw_data[key] for key in range(start_point, end_point+1)]).reshape(-1, 1)
-
-                        data_segment = self.smoothen(np.hstack((remaining_data, roll_data, pitch_data, yaw_data)))
-
-                        feature_matrix = self.extract_feature_matrix(data_segment)
-                        if len(self.peaks) == 3:
-                            self.normalization_matrix = np.where(feature_matrix == 0, 1e-8, feature_matrix)
-
-                        feature_matrix = feature_matrix / self.normalization_matrix
-                        feature_matrix = feature_matrix.reshape(1, -1)
-                        feature_matrix_scaled = self.scaler.transform(feature_matrix)
-                        self.data_segments.append(feature_matrix_scaled.flatten())
-                        
-                        prediction = self.predict_rnn(self.rnn_model)
+                        stage_start = time.perf_counter()
+                        if self.incremental:
+                            prediction = self.predict_rnn_incremental()
+                        else:
+                            prediction = self.predict_rnn(self.rnn_model)
+                        self._time_stage('prediction', stage_start)
 
                         self.all_fatigue.append(prediction)
+                        if self.recorder is not None:
+                            self.recorder.append_repetition(start_point, end_point, prediction)
                         label = self.get_label(prediction)
                         self.fatigue = f'{label} ({prediction:.1f})'
+                        self._publish('prediction')
+                        # from the arrival of the sample that closed the repetition to the updated fatigue
+                        if self.current_arrival_time is not None:
+                            self._time_stage('latency', self.current_arrival_time)
+
+    def subscribe(self, callback):
+        """
+        Registers callback(event) for every StreamerEvent. It runs on the worker thread, so it should only hand
+        the event over (e.g. to a Qt signal) and return.
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def _publish(self, kind):
+        prediction = self.all_fatigue[-1] if self.all_fatigue else None
+        event = StreamerEvent(kind, len(self.peaks), len(self.all_fatigue), prediction, self.fatigue)
+        for callback in list(self.subscribers):
+            callback(event)
+
+    def _extend_prefix_stats(self, start_point, end_point):
+        """
+        Feeds the running sums the rows up to end_point. Rows before start_point are never queried again.
+        """
+        if len(self.prefix_stats) < start_point:
+            self.prefix_stats.reset(start_point)
+        rows = self.samples.rows(len(self.prefix_stats), end_point+1)[:, self.feature_plan.channels]
+        self.prefix_stats.append(rows)
+        self.prefix_stats.discard_before(start_point)
+
+    def _time_stage(self, stage, stage_start):
+        self.stage_times[stage].append(time.perf_counter() - stage_start)
+
+    def get_segment(self, start_point, end_point):
+        """
+        Returns rows start_point to end_point (inclusive) of every channel, indexed as in imu_data.csv, as a view
+        into self.samples that is valid until the next row is written.
+        """
+        return self.samples.rows(start_point, end_point+1)
 
     def get_label(self, value):
         if value < 3:
@@ -176,120 +341,132 @@ class DataStreamer():
         return 'Moderate'
     
     def predict_rnn(self, model):
-        if len(self.data_segments) > 0:
-            X_test = np.stack(self.data_segments)
-            X_test = X_test[:, self.rnn_indices]
-            X_test = np.expand_dims(X_test, axis=0)
+        if len(self.feature_sequence) > 0:
+            X_test = self.feature_sequence.values[np.newaxis]
             prediction = np.squeeze(model.predict(X_test, verbose=0))
             if len(prediction.shape) == 0:
                 return prediction
             else:
                 return prediction[-1]
 
-    def smoothen(self, data_segment, window_size_ms = 100):
+    def predict_rnn_incremental(self):
+        """
+        Same output as predict_rnn, but only advances the LSTM by the newest repetition.
+        """
+        if len(self.feature_sequence) > 0:
+            return self.rnn_stepper.step(self.feature_sequence.values[-1])
+
+    def smoothen(self, data_segment, window_size_ms = 100, channels=None):
         # 100 ms equates to sliding window of 5 samples
-        # data segment is a 2d numpy array
-        df = pd.DataFrame(data_segment)
+        # data segment is a 2d numpy array, of which only the given columns are smoothed
+        df = pd.DataFrame(data_segment if channels is None else data_segment[:, channels])
         sampling_interval_ms = 20
         window_size_samples = int(window_size_ms / sampling_interval_ms)
         smoothened_df = df.rolling(window=window_size_samples, min_periods=1).mean()
         return smoothened_df.values
 
-    def extract_feature_matrix(self, data_segment):
-        feature_matrix = []
-        for col_index in range(data_segment.shape[1]):
-            feature_matrix.append(self.extract_features(data_segment[:, col_index]))
-        return np.array(feature_matrix).flatten()
-
-    def extract_features(self, data):
-        features = []
-        features.append(np.mean(data))                           # mean
-        features.append(np.std(data))                            # standard deviation
-        features.append(skew(data))                              # skewness
-        features.append(kurtosis(data))                          # kurtosis
-        features.append(np.max(data) - np.min(data))             # range
-        features.append(np.max(data))                            # maximum
-        features.append(np.min(data))                            # minimum
-        features.append(np.sqrt(np.mean(data**2)))               # root mean square
-        features.append(np.corrcoef(data[:-1], data[1:])[0, 1])  # lag 1 autocorrelation
-
-        # power spectral density
-        nperseg = min(256, len(data))
-        f, Pxx = welch(data, nperseg=nperseg)
-        features.append(np.sum(Pxx))                             # total power
-
-        # fast fourier transform
-        fft_values = np.abs(fft(data))
-        fft_freqs = np.fft.fftfreq(len(fft_values))
-        peaks, _ = find_peaks(fft_values)                        # dominant frequency
-        features.append(fft_freqs[peaks[0]] if peaks.size > 0 else 0)      
-        return features
-    
     def euler_callback_wrist(self, message):
-        key = self.euler_wrist_i
-        self._update_data(key, 'Wrist Roll (deg)', message.roll)
-        self._update_data(key, 'Wrist Pitch (deg)', message.pitch)
-        self._update_data(key, 'Wrist Yaw (deg)', message.yaw)
-
-        if self.data[key]['Arm Pitch (deg)'] is not None:
-            self._update_diff(key, type='pitch')
-
-        if self.data[key]['Arm Roll (deg)'] is not None:
-            self._update_diff(key, type='roll')
-
-        if self.data[key]['Arm Yaw (deg)'] is not None:
-            self._update_diff(key, type='yaw')
-
-        self.euler_wrist_i += 1
-        self.timestamps.append(datetime.now())
+        self._enqueue('euler_wrist', message.timestamp, (message.roll, message.pitch, message.yaw))
 
     def euler_callback_arm(self, message):
-        key = self.euler_arm_i
-        self._update_data(key, 'Arm Roll (deg)', message.roll)
-        self._update_data(key, 'Arm Pitch (deg)', message.pitch)
-        self._update_data(key, 'Arm Yaw (deg)', message.yaw)
-        
-        if self.data[key]['Wrist Pitch (deg)'] is not None:
-            self._update_diff(key, type='pitch')
-
-        if self.data[key]['Wrist Roll (deg)'] is not None:
-            self._update_diff(key, type='roll')
-
-        if self.data[key]['Wrist Yaw (deg)'] is not None:
-            self._update_diff(key, type='yaw')
-
-        self.euler_arm_i += 1
+        self._enqueue('euler_arm', message.timestamp, (message.roll, message.pitch, message.yaw))
 
     def inertial_callback_wrist(self, message):
-        key = self.inertial_wrist_i
-        self._update_data(key, 'Wrist Gyroscope X (deg/s)', message.gyroscope_x)
-        self._update_data(key, 'Wrist Gyroscope Y (deg/s)', message.gyroscope_y)
-        self._update_data(key, 'Wrist Gyroscope Z (deg/s)', message.gyroscope_z)
-        self._update_data(key, 'Wrist Accelerometer X (g)', message.accelerometer_x)
-        self._update_data(key, 'Wrist Accelerometer Y (g)', message.accelerometer_y)
-        self._update_data(key, 'Wrist Accelerometer Z (g)', message.accelerometer_z)
-
-        gyro_magnitude = self._calculate_magnitude(message.gyroscope_x, message.gyroscope_y, message.gyroscope_z)
-        accel_magnitude = self._calculate_magnitude(message.accelerometer_x, message.accelerometer_y, message.accelerometer_z)
-
-        self._update_data(key, 'Wrist Gyroscope Magnitude (deg/s)', gyro_magnitude)
-        self._update_data(key, 'Wrist Accelerometer Magnitude (g)', accel_magnitude)
-
-        self.inertial_wrist_i += 1
+        self._enqueue('inertial_wrist', message.timestamp, (
+            message.gyroscope_x, message.gyroscope_y, message.gyroscope_z,
+            message.accelerometer_x, message.accelerometer_y, message.accelerometer_z))
 
     def inertial_callback_arm(self, message):
-        key = self.inertial_arm_i
-        self._update_data(key, 'Arm Gyroscope X (deg/s)', message.gyroscope_x)
-        self._update_data(key, 'Arm Gyroscope Y (deg/s)', message.gyroscope_y)
-        self._update_data(key, 'Arm Gyroscope Z (deg/s)', message.gyroscope_z)
-        self._update_data(key, 'Arm Accelerometer X (g)', message.accelerometer_x)
-        self._update_data(key, 'Arm Accelerometer Y (g)', message.accelerometer_y)
-        self._update_data(key, 'Arm Accelerometer Z (g)', message.accelerometer_z)
-
-        gyro_magnitude = self._calculate_magnitude(message.gyroscope_x, message.gyroscope_y, message.gyroscope_z)
-        accel_magnitude = self._calculate_magnitude(message.accelerometer_x, message.accelerometer_y, message.accelerometer_z)
-
-        self._update_data(key, 'Arm Gyroscope Magnitude (deg/s)', gyro_magnitude)
-        self._update_data(key, 'Arm Accelerometer Magnitude (g)', accel_magnitude)
-
-        self.inertial_arm_i += 1
+        self._enqueue('inertial_arm', message.timestamp, (
+            message.gyroscope_x, message.gyroscope_y, message.gyroscope_z,
+            message.accelerometer_x, message.accelerometer_y, message.accelerometer_z))
+
+    def _enqueue(self, stream, timestamp, values):
+        """
+        Runs on the xIMU callback threads: only hands the raw sample, its device timestamp (microseconds) and its
+        host arrival time over to the worker thread.
+        Each stream is fed by a single callback thread, so its drop counter needs no lock.
+        """
+        try:
+            self.sample_queue.put_nowait((stream, timestamp, values, time.time(), time.perf_counter()))
+        except queue.Full:
+            self.dropped_samples[stream] += 1
+
+    def _process_samples(self):
+        """
+        Worker thread: aligns the queued samples and processes every row they complete, which runs peak detection,
+        feature extraction and inference off the xIMU callback threads.
+        """
+        while True:
+            self.max_queue_depth = max(self.max_queue_depth, self.sample_queue.qsize())
+            stream, timestamp, values, host_time, arrival_time = self.sample_queue.get()
+            if stream is None:
+                # the rows still waiting for the slowest stream, with its last values held
+                for row in self.aligner.flush():
+                    self._process_row(*row)
+                break
+            self.current_arrival_time = arrival_time
+            for row in self.aligner.add(stream, timestamp, values, host_time):
+                self._process_row(*row)
+            self.processed_samples += 1
+            if self.recorder is not None:
+                self._record()
+
+    def pipeline_stats(self):
+        return {
+            'queue depth': self.sample_queue.qsize(),
+            'max queue depth': self.max_queue_depth,
+            'processed samples': self.processed_samples,
+            'dropped samples': dict(self.dropped_samples),
+            'gap ranges': len(self.gaps),
+            'alignment': self.aligner.stats(),
+        }
+
+    def _process_row(self, host_time, values, gaps):
+        """
+        Writes one aligned row, with the sensor magnitudes and its host time, then checks it for a peak.
+        """
+        row = np.full(len(self.samples.columns), np.nan)
+        for stream, stream_values in values.items():
+            row[STREAM_INDICES[stream]] = stream_values
+        for vector_columns, magnitude_column in MAGNITUDES:
+            row[magnitude_column] = self._calculate_magnitude(*row[vector_columns])
+        row[self.samples.column_index[TIME_COLUMN]] = host_time
+        index = self.samples.write('aligned', row)
+        if gaps:
+            self._add_gap(index, index)
+        if self.recorder is not None:
+            self._record_gaps()
+        self._update_differences()
+
+    def _add_gap(self, start_row, end_row):
+        """
+        Adds rows start_row to end_row to the gap ranges, merged with the ranges it overlaps or adjoins.
+        Ranges already handed to the recorder are kept as they are.
+        """
+        # only the trailing ranges that reach start_row can merge with it
+        first = len(self.gaps)
+        while first > self.num_recorded_gaps and self.gaps[first - 1][1] >= start_row - 1:
+            first -= 1
+        pending = sorted(self.gaps[first:] + [[start_row, end_row]])
+        del self.gaps[first:]
+        for start, end in pending:
+            if self.gaps and start <= self.gaps[-1][1] + 1:
+                if len(self.gaps) > self.num_recorded_gaps:
+                    self.gaps[-1][1] = max(self.gaps[-1][1], end)
+                    continue
+                start = self.gaps[-1][1] + 1
+                if start > end:
+                    continue
+            self.gaps.append([start, end])
+
+    def _record_gaps(self, final=False):
+        """
+        Hands the recorder every gap range that can no longer grow: all but one still ending at the newest row.
+        """
+        num_closed = len(self.gaps)
+        if not final and self.gaps and self.gaps[-1][1] == len(self.samples) - 1:
+            num_closed -= 1
+        for start_row, end_row in self.gaps[self.num_recorded_gaps:num_closed]:
+            self.recorder.append_gap(start_row, end_row)
+        self.num_recorded_gaps = max(self.num_recorded_gaps, num_closed)
@@ -0,0 +1,281 @@
+import json
+import os
+import numpy as np
+from scipy.signal import welch, find_peaks
+from scipy.stats import skew, kurtosis
+from scipy.fft import fft, rfft
+from PrefixStats import NUM_MOMENT_STATISTICS
+
+# order of the statistics computed per channel by FeaturePlan.compute_statistic and preprocess_data.ipynb
+STATISTICS = [
+    'mean',
+    'standard deviation',
+    'skewness',
+    'kurtosis',
+    'range',
+    'maximum',
+    'minimum',
+    'root mean square',
+    'lag 1 autocorrelation',
+    'total power',
+    'dominant frequency',
+]
+# channels of imu_data.csv and DataStreamer.samples, in column order; feature index // len(STATISTICS) indexes them
+IMU_COLUMNS = [
+    'Wrist Gyroscope X (deg/s)',
+    'Wrist Gyroscope Y (deg/s)',
+    'Wrist Gyroscope Z (deg/s)',
+    'Wrist Accelerometer X (g)',
+    'Wrist Accelerometer Y (g)',
+    'Wrist Accelerometer Z (g)',
+    'Wrist Roll (deg)',
+    'Wrist Pitch (deg)',
+    'Wrist Yaw (deg)',
+    'Arm Gyroscope X (deg/s)',
+    'Arm Gyroscope Y (deg/s)',
+    'Arm Gyroscope Z (deg/s)',
+    'Arm Accelerometer X (g)',
+    'Arm Accelerometer Y (g)',
+    'Arm Accelerometer Z (g)',
+    'Arm Roll (deg)',
+    'Arm Pitch (deg)',
+    'Arm Yaw (deg)',
+    'Wrist Gyroscope Magnitude (deg/s)',
+    'Wrist Accelerometer Magnitude (g)',
+    'Arm Gyroscope Magnitude (deg/s)',
+    'Arm Accelerometer Magnitude (g)',
+    'Difference Roll (deg)',
+    'Difference Pitch (deg)',
+    'Difference Yaw (deg)',
+]
+# the features the RNN in models/ takes, written by Scripts/feature_search.py and read by training and DataStreamer
+FEATURE_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'features.json')
+# bump when the layout of the manifest changes
+MANIFEST_FORMAT = 1
+
+class FeaturePlan():
+    """
+    Maps indices into the flattened (channel, statistic) feature vector back to the channels and statistics
+    they come from, so only the selected features are computed.
+    compute_statistic is the per-column reference expression of every statistic, so the results are
+    bit-identical to indexing the full feature vector.
+    """
+    def __init__(self, feature_indices, num_statistics=len(STATISTICS)):
+        self.feature_indices = list(feature_indices)
+        self.num_statistics = num_statistics
+        self.channels = sorted({index // num_statistics for index in self.feature_indices})
+        # for every needed channel, the (output position, statistic) pairs computed from it
+        self.channel_statistics = {channel: [] for channel in self.channels}
+        for position, index in enumerate(self.feature_indices):
+            self.channel_statistics[index // num_statistics].append((position, index % num_statistics))
+        # channels with a statistic that needs the whole segment (Welch PSD, FFT) rather than running sums
+        self.spectral_channels = [channel for channel in self.channels
+                                  if any(statistic >= NUM_MOMENT_STATISTICS for _, statistic in self.channel_statistics[channel])]
+
+    def __len__(self):
+        return len(self.feature_indices)
+
+    def compute(self, data_segment):
+        """
+        Computes the planned features for a segment whose columns are self.channels, in feature_indices order.
+        """
+        features = np.empty(len(self.feature_indices))
+        for column, channel in enumerate(self.channels):
+            data = data_segment[:, column]
+            for position, statistic in self.channel_statistics[channel]:
+                features[position] = self.compute_statistic(data, statistic)
+        return features
+
+    def compute_from_moments(self, moments, spectral_segment):
+        """
+        Same features as compute, taking statistics 0-8 from PrefixStats.moments over self.channels and computing
+        the rest from a segment whose columns are self.spectral_channels.
+        """
+        features = np.empty(len(self.feature_indices))
+        for column, channel in enumerate(self.channels):
+            for position, statistic in self.channel_statistics[channel]:
+                if statistic < NUM_MOMENT_STATISTICS:
+                    features[position] = moments[column, statistic]
+                else:
+                    data = spectral_segment[:, self.spectral_channels.index(channel)]
+                    features[position] = self.compute_statistic(data, statistic)
+        return features
+
+    def compute_statistic(self, data, statistic):
+        if statistic == 0:
+            return np.mean(data)
+        if statistic == 1:
+            return np.std(data)
+        if statistic == 2:
+            return skew(data)
+        if statistic == 3:
+            return kurtosis(data)
+        if statistic == 4:
+            return np.max(data) - np.min(data)
+        if statistic == 5:
+            return np.max(data)
+        if statistic == 6:
+            return np.min(data)
+        if statistic == 7:
+            return np.sqrt(np.mean(data**2))
+        if statistic == 8:
+            return np.corrcoef(data[:-1], data[1:])[0, 1]
+        if statistic == 9:
+            nperseg = min(256, len(data))
+            f, Pxx = welch(data, nperseg=nperseg)
+            return np.sum(Pxx)
+        if statistic == 10:
+            fft_values = np.abs(fft(data))
+            fft_freqs = np.fft.fftfreq(len(fft_values))
+            peaks, _ = find_peaks(fft_values)
+            return fft_freqs[peaks[0]] if peaks.size > 0 else 0
+        raise ValueError(f'Unknown statistic index {statistic}')
+
+    def restrict_scaler(self, scaler):
+        """
+        Returns the mean and scale of a fitted StandardScaler restricted to the planned features.
+        """
+        return scaler.mean_[self.feature_indices], scaler.scale_[self.feature_indices]
+
+
+def extract_feature_matrices(segments):
+    """
+    Feature vectors (num_segments, channels * 11) of a list of variable-length (samples, channels) segments.
+    Statistics 0-8 are computed for every segment and channel at once on a zero-padded array with a validity mask;
+    total power and dominant frequency depend on the segment length, so those are computed per group of equal-length
+    segments with axis-wise welch and rfft.
+    Values match the per-column compute_statistic to floating point round-off (the spectral statistics bit for bit).
+    """
+    segments = [np.asarray(segment, dtype=float) for segment in segments]
+    if len(segments) == 0:
+        return np.empty((0, 0))
+    num_channels = segments[0].shape[1]
+    lengths = np.array([len(segment) for segment in segments])
+    # (segments, channels, samples) so every reduction runs along the contiguous last axis
+    padded = np.zeros((len(segments), num_channels, lengths.max()))
+    for i, segment in enumerate(segments):
+        padded[i, :, :len(segment)] = segment.T
+    mask = np.arange(lengths.max()) < lengths[:, np.newaxis, np.newaxis]
+
+    features = np.empty((len(segments), num_channels, len(STATISTICS)))
+    features[:, :, :NUM_MOMENT_STATISTICS] = _masked_moments(padded, mask, lengths)
+    for length in np.unique(lengths):
+        group = np.flatnonzero(lengths == length)
+        data = padded[group, :, :length]
+        features[group, :, 9] = _total_power(data)
+        features[group, :, 10] = _dominant_frequency(data)
+    return features.reshape(len(segments), -1)
+
+
+def load_feature_manifest(path=FEATURE_MANIFEST):
+    """
+    Reads a feature manifest written by save_feature_manifest and checks it against STATISTICS.
+    manifest['feature_indices'] are the columns of the 275-feature vector the RNN was trained on, in input order.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ValueError(f'{path} has manifest format {manifest.get("format")}, expected {MANIFEST_FORMAT}')
+    if manifest['statistics'] != STATISTICS:
+        raise ValueError(f'{path} was written for the statistics {manifest["statistics"]}, not those of FeaturePlan.STATISTICS')
+    num_features = manifest['num_channels'] * len(STATISTICS)
+    if not manifest['feature_indices'] or not all(0 <= index < num_features for index in manifest['feature_indices']):
+        raise ValueError(f'{path} has feature indices outside 0-{num_features - 1}')
+    return manifest
+
+def save_feature_manifest(path, feature_indices, channel_names, **details):
+    """
+    Writes the selected features as a feature manifest. The version is one more than that of the manifest
+    already at path, so a retrained model can be matched to the selection it was trained on.
+    details (search method, scores, ...) are stored as they are.
+    """
+    version = 1
+    if os.path.exists(path):
+        with open(path) as f:
+            version = json.load(f).get('version', 0) + 1
+    feature_indices = [int(index) for index in feature_indices]
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'version': version,
+        'feature_indices': feature_indices,
+        'feature_names': [f'{channel_names[index // len(STATISTICS)]} {STATISTICS[index % len(STATISTICS)]}'
+                          for index in feature_indices],
+        'num_channels': len(channel_names),
+        'statistics': STATISTICS,
+        **details,
+    }
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _masked_moments(padded, mask, lengths):
+    n = lengths[:, np.newaxis].astype(float)
+    mean = np.sum(padded, axis=-1) / n
+    centered = np.where(mask, padded - mean[..., np.newaxis], 0)
+    squared = centered**2
+    m2 = np.sum(squared, axis=-1) / n
+    m3 = np.sum(squared * centered, axis=-1) / n
+    m4 = np.sum(squared**2, axis=-1) / n
+    maximum = np.max(np.where(mask, padded, -np.inf), axis=-1)
+    minimum = np.min(np.where(mask, padded, np.inf), axis=-1)
+
+    # lag 1 autocorrelation: Pearson correlation of x[:-1] and x[1:] as np.corrcoef computes it
+    pairs = mask[..., 1:]
+    m = n - 1
+    head = padded[..., :-1]
+    tail = padded[..., 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        head_centered = np.where(pairs, head - np.sum(np.where(pairs, head, 0), axis=-1, keepdims=True) / m[..., np.newaxis], 0)
+        tail_centered = np.where(pairs, tail - np.sum(np.where(pairs, tail, 0), axis=-1, keepdims=True) / m[..., np.newaxis], 0)
+        autocorrelation = (np.sum(head_centered * tail_centered, axis=-1)
+                           / np.sqrt(np.sum(head_centered**2, axis=-1) * np.sum(tail_centered**2, axis=-1)))
+        autocorrelation = np.clip(autocorrelation, -1, 1)
+        # scipy.stats.skew and kurtosis return nan for a constant signal
+        constant = m2 <= (np.finfo(float).eps * mean)**2
+        skewness = np.where(constant, np.nan, m3 / m2**1.5)
+        kurt = np.where(constant, np.nan, m4 / m2**2 - 3)
+
+    moments = np.empty(padded.shape[:2] + (NUM_MOMENT_STATISTICS,))
+    moments[..., 0] = mean
+    moments[..., 1] = np.sqrt(m2)
+    moments[..., 2] = skewness
+    moments[..., 3] = kurt
+    moments[..., 4] = maximum - minimum
+    moments[..., 5] = maximum
+    moments[..., 6] = minimum
+    moments[..., 7] = np.sqrt(np.sum(padded**2, axis=-1) / n)
+    moments[..., 8] = autocorrelation
+    return moments
+
+
+def _total_power(data):
+    nperseg = min(256, data.shape[-1])
+    f, Pxx = welch(data, nperseg=nperseg, axis=-1)
+    return np.sum(Pxx, axis=-1)
+
+
+def _dominant_frequency(data):
+    """
+    Frequency of the first find_peaks peak of |fft| along the last axis, 0 when there is none.
+    The full magnitude spectrum of a real signal is the rfft magnitudes followed by their mirror image.
+    """
+    length = data.shape[-1]
+    half = np.abs(rfft(data, axis=-1))
+    fft_values = np.concatenate((half, half[..., 1:(length + 1) // 2][..., ::-1]), axis=-1)
+    fft_freqs = np.fft.fftfreq(length)
+    rows = fft_values.reshape(-1, length)
+    rising = rows[:, 1:-1] > rows[:, :-2]
+    falling = rows[:, 1:-1] > rows[:, 2:]
+    strict = rising & falling
+    has_peak = strict.any(axis=1)
+    first_peak = np.argmax(strict, axis=1)
+    frequencies = np.where(has_peak, fft_freqs[first_peak + 1], 0.0)
+
+    # find_peaks also reports the middle of flat peaks; rows with a tie before their first strict peak use it directly
+    ties = rows[:, 1:] == rows[:, :-1]
+    before_peak = np.arange(ties.shape[1]) < np.where(has_peak, first_peak + 1, ties.shape[1])[:, np.newaxis]
+    for row in np.flatnonzero(np.any(ties & before_peak, axis=1)):
+        peaks, _ = find_peaks(rows[row])
+        frequencies[row] = fft_freqs[peaks[0]] if peaks.size > 0 else 0
+    return frequencies.reshape(data.shape[:-1])
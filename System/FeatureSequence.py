@@ -0,0 +1,46 @@
+import numpy as np
+
+class FeatureSequence():
+    """
+    The RNN input of a session: one normalized and scaled feature vector per repetition, in a preallocated
+    (capacity, features) array that doubles when full.
+    Dividing by the normalization matrix of the first repetition and applying the StandardScaler are both affine,
+    so once the first repetition fixes the normalization they fold into one scale and one offset vector:
+        (features / normalization - mean) / std = features * scale + offset
+    Every repetition after that is a multiply and an add written in place into the next row.
+    """
+    def __init__(self, scaler_mean, scaler_scale, zero_value=1e-8, initial_capacity=1024):
+        self.scaler_mean = np.asarray(scaler_mean, dtype=float)
+        self.scaler_scale = np.asarray(scaler_scale, dtype=float)
+        self.zero_value = zero_value
+        self.normalization_matrix = None
+        self.scale = None
+        self.offset = -self.scaler_mean / self.scaler_scale
+        self.array = np.empty((initial_capacity, len(self.scaler_mean)))
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def values(self):
+        """
+        (repetitions, features) view of the scaled feature vectors so far.
+        """
+        return self.array[:self.length]
+
+    def append(self, features):
+        """
+        Normalizes and scales the feature vector of the next repetition and returns its row (a view).
+        The first vector appended becomes the normalization matrix, with zeros replaced by zero_value.
+        """
+        if self.normalization_matrix is None:
+            self.normalization_matrix = np.where(features == 0, self.zero_value, features)
+            self.scale = 1 / (self.normalization_matrix * self.scaler_scale)
+        if self.length == len(self.array):
+            self.array = np.concatenate([self.array, np.empty_like(self.array)])
+        row = self.array[self.length]
+        np.multiply(features, self.scale, out=row)
+        np.add(row, self.offset, out=row)
+        self.length += 1
+        return row
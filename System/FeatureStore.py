@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# experiments in which the participant did not use the 3 kg weights
+SKIP = {
+    'individual_00' : ['experiment_1', 'experiment_2'],
+    'individual_03' : ['experiment_1', 'experiment_2'],
+    'individual_04' : ['experiment_1', 'experiment_2'],
+    'individual_07' : ['experiment_1', 'experiment_4'],
+    'individual_08' : ['experiment_1', 'experiment_2'],
+    'individual_11' : ['experiment_2'],
+    'individual_14' : ['experiment_2'],
+    'individual_17' : ['experiment_1'],
+    'individual_23' : ['experiment_3', 'experiment_4'],
+    'individual_47' : ['experiment_1', 'experiment_2'],
+    'individual_49' : ['experiment_1', 'experiment_2'],
+    'individual_51' : ['experiment_1'],
+    'individual_52' : ['experiment_1', 'experiment_2'],
+    'individual_53' : ['experiment_1'],
+    'individual_54' : ['experiment_1', 'experiment_2'],
+    'individual_55' : ['experiment_1'],
+}
+
+STORE_FOLDER = 'feature_store'
+INDEX_DTYPE = np.dtype([('individual', 'U32'), ('experiment', 'U32'), ('offset', '<i8'), ('length', '<i8'), ('skip', '?')])
+
+def _experiment_folders(features_folder):
+    """
+    (individual_xx, experiment_y) of every experiment in features_folder that has an X.npy, in store order.
+    """
+    experiments = []
+    individual_folders = [folder for folder in sorted(os.listdir(features_folder)) if 'individual' in folder]
+    for individual_folder in individual_folders:
+        experiment_folders = [folder for folder in sorted(os.listdir(f'{features_folder}/{individual_folder}')) if 'experiment' in folder]
+        for experiment_folder in experiment_folders:
+            if os.path.exists(f'{features_folder}/{individual_folder}/{experiment_folder}/X.npy'):
+                experiments.append((individual_folder, experiment_folder))
+    return experiments
+
+def source_stats(features_folder):
+    """
+    Size and mtime of the X.npy and y.npy of every experiment, which the store records to detect that it is stale.
+    """
+    stats = {}
+    for individual_folder, experiment_folder in _experiment_folders(features_folder):
+        folder_path = f'{features_folder}/{individual_folder}/{experiment_folder}'
+        stats[f'{individual_folder}/{experiment_folder}'] = [
+            [stat.st_size, stat.st_mtime_ns] for stat in (os.stat(f'{folder_path}/{name}') for name in ['X.npy', 'y.npy'])]
+    return stats
+
+def is_current(features_folder, store_folder=None):
+    """
+    Whether the store exists and was built from the current X.npy and y.npy files (or the features folder is gone).
+    """
+    store_folder = store_folder or f'{features_folder}/{STORE_FOLDER}'
+    if not os.path.exists(f'{store_folder}/index.npy'):
+        return False
+    if not os.path.isdir(features_folder):
+        return True
+    if not os.path.exists(f'{store_folder}/sources.json'):
+        return False
+    with open(f'{store_folder}/sources.json') as f:
+        return json.load(f) == source_stats(features_folder)
+
+def build_feature_store(features_folder, store_folder=None):
+    """
+    Packs every Features Data/individual_xx/experiment_y/X.npy and y.npy into one float32 X (rows, features),
+    one float32 y (rows,) and an index with the row offset and length of each experiment, all plain .npy files.
+    The size and mtime of every source file go to sources.json.
+    """
+    store_folder = store_folder or f'{features_folder}/{STORE_FOLDER}'
+    index, all_X, all_y = [], [], []
+    offset = 0
+    # taken before reading, so a file rewritten during the build leaves the store stale rather than current
+    sources = source_stats(features_folder)
+    for experiment in sources:
+        individual_folder, experiment_folder = experiment.split('/')
+        folder_path = f'{features_folder}/{individual_folder}/{experiment_folder}'
+        experiment_X = np.load(f'{folder_path}/X.npy', allow_pickle=True).astype('float32')
+        experiment_y = np.load(f'{folder_path}/y.npy', allow_pickle=True).astype('float32')
+        skip = experiment_folder in SKIP.get(individual_folder, [])
+        index.append((individual_folder, experiment_folder, offset, len(experiment_y), skip))
+        all_X.append(experiment_X.reshape(len(experiment_y), -1))
+        all_y.append(experiment_y)
+        offset += len(experiment_y)
+
+    os.makedirs(store_folder, exist_ok=True)
+    np.save(f'{store_folder}/X.npy', np.concatenate(all_X, axis=0))
+    np.save(f'{store_folder}/y.npy', np.concatenate(all_y, axis=0))
+    with open(f'{store_folder}/sources.json', 'w') as f:
+        json.dump(sources, f)
+    # written last, so an interrupted build is detected as missing
+    np.save(f'{store_folder}/index.npy', np.array(index, dtype=INDEX_DTYPE))
+    print(f'Packed {len(index)} experiments ({offset} repetitions) into {store_folder}')
+    return store_folder
+
+
+class FeatureStore():
+    """
+    Memory-mapped view of the store written by build_feature_store. Opening it reads only the index and checks
+    the sizes and mtimes of the source files; the slices returned for an experiment, an individual or a fold
+    are views into the mapped arrays. A missing or stale store is rebuilt, or raises without build_if_missing.
+    """
+    def __init__(self, features_folder, store_folder=None, build_if_missing=True):
+        self.store_folder = store_folder or f'{features_folder}/{STORE_FOLDER}'
+        if not is_current(features_folder, self.store_folder):
+            if not build_if_missing:
+                state = 'stale' if os.path.exists(f'{self.store_folder}/index.npy') else 'missing'
+                raise FileNotFoundError(f'The feature store in {self.store_folder} is {state}. Run python System/FeatureStore.py build')
+            build_feature_store(features_folder, self.store_folder)
+        self.X = np.load(f'{self.store_folder}/X.npy', mmap_mode='r')
+        self.y = np.load(f'{self.store_folder}/y.npy', mmap_mode='r')
+        self.index = np.load(f'{self.store_folder}/index.npy')
+
+    def __len__(self):
+        return len(self.index)
+
+    def index_frame(self):
+        return pd.DataFrame(self.index)
+
+    def individuals(self, include_skipped=False):
+        rows = self.index if include_skipped else self.index[~self.index['skip']]
+        return sorted(set(rows['individual']))
+
+    def find(self, individual, experiment):
+        """
+        Index row of e.g. ('individual_00', 'experiment_1').
+        """
+        rows = np.flatnonzero((self.index['individual'] == individual) & (self.index['experiment'] == experiment))
+        if len(rows) == 0:
+            raise KeyError(f'{individual}/{experiment} is not in the feature store')
+        return rows[0]
+
+    def experiment(self, row):
+        """
+        (X, y) of the experiment in index row `row`.
+        """
+        offset, length = self.index['offset'][row], self.index['length'][row]
+        return self.X[offset:offset + length], self.y[offset:offset + length]
+
+    def rows(self, individuals=None, include_skipped=False):
+        """
+        Index rows of the experiments of the given individuals (all when None), without the skipped ones by default.
+        """
+        selected = np.ones(len(self.index), dtype=bool)
+        if individuals is not None:
+            selected &= np.isin(self.index['individual'], list(individuals))
+        if not include_skipped:
+            selected &= ~self.index['skip']
+        return np.flatnonzero(selected)
+
+    def experiments(self, individuals=None, include_skipped=False):
+        """
+        Lists of per-experiment X and y views for the given individuals, in index order.
+        """
+        X, y = [], []
+        for row in self.rows(individuals, include_skipped):
+            experiment_X, experiment_y = self.experiment(row)
+            X.append(experiment_X)
+            y.append(experiment_y)
+        return X, y
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Packs Data/Features Data into a memory-mapped feature store')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--features-folder', default='./Data/Features Data')
+    args = parser.parse_args()
+    build_feature_store(args.features_folder)
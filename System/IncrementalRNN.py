@@ -0,0 +1,55 @@
+import numpy as np
+
+class IncrementalRNN():
+    """
+    Steps a trained Masking -> LSTM -> Dense model one repetition at a time.
+    The LSTM hidden and cell state are carried between calls, so each new feature vector costs a single
+    timestep instead of replaying the whole session through model.predict.
+    """
+    def __init__(self, model):
+        if hasattr(model, 'lstm_step'):
+            # NumpyLSTM already exposes a single timestep and the output layer
+            self.mask_value = model.mask_value
+            self.units = model.units
+            self.lstm_step = model.lstm_step
+            self.output = model.output
+        else:
+            self._wrap_keras(model)
+        self.reset()
+
+    def _wrap_keras(self, model):
+        self.mask_value = None
+        lstm = None
+        dense = None
+        for layer in model.layers:
+            class_name = layer.__class__.__name__
+            if class_name == 'Masking':
+                self.mask_value = layer.mask_value
+            elif class_name == 'LSTM':
+                lstm = layer
+            elif class_name == 'Dense':
+                dense = layer
+        if lstm is None or dense is None:
+            raise ValueError('model must contain an LSTM layer followed by a Dense layer')
+        self.units = lstm.units
+        self.lstm_step = lambda x, states: lstm.cell(x, states, training=False)
+        self.output = dense
+
+    def reset(self):
+        """
+        Clears the carried state, e.g. at the start of a new session.
+        """
+        self.states = [np.zeros((1, self.units), dtype='float32'), np.zeros((1, self.units), dtype='float32')]
+        self.last_prediction = None
+
+    def step(self, x):
+        """
+        Advances the LSTM by one timestep with the feature vector x and returns the prediction for it.
+        """
+        x = np.asarray(x, dtype='float32').reshape(1, -1)
+        if self.mask_value is not None and np.all(x == self.mask_value):
+            # masked timesteps leave the state untouched and repeat the previous output, as in the Masking layer
+            return self.last_prediction
+        h, self.states = self.lstm_step(x, self.states)
+        self.last_prediction = float(np.squeeze(self.output(h)))
+        return self.last_prediction
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from DataStreamer import DataStreamer
+from ModelLoader import ModelLoader
+from ReplayConnection import ReplayConnection
+from StepScheduler import StepScheduler
+from UdpConnection import UdpConnection, UdpSender
+
+def current_rss_mb():
+    """
+    Resident memory of this process in MB, from /proc (Linux).
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+def thread_cpu_seconds(thread):
+    """
+    User + system CPU time of a running thread of this process, from /proc (Linux); None once it has exited.
+    """
+    try:
+        with open(f'/proc/self/task/{thread.native_id}/stat') as f:
+            # fields after the parenthesized thread name; utime and stime are the 14th and 15th of the line
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (FileNotFoundError, TypeError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class Session():
+    """
+    One station: a DataStreamer fed by a wrist and an arm UdpConnection, each on its own local port.
+    """
+    def __init__(self, name, model_loader, folder_path=None, host='127.0.0.1', step_scheduler=None, **streamer_kwargs):
+        self.name = name
+        self.folder_path = folder_path
+        self.created = time.time()
+        self.wrist_connection = UdpConnection(host)
+        self.arm_connection = None
+        try:
+            self.arm_connection = UdpConnection(host)
+            self.wrist_connection.open()
+            self.arm_connection.open()
+            self.streamer = DataStreamer(self.wrist_connection, self.arm_connection, folder_path=folder_path,
+                                         model_loader=model_loader, step_scheduler=step_scheduler, **streamer_kwargs)
+        except Exception:
+            # otherwise the ports stay bound until the sockets are garbage collected
+            for connection in [self.wrist_connection, self.arm_connection]:
+                if connection is not None:
+                    connection.close()
+            raise
+
+    def threads(self):
+        return [self.streamer.worker, self.wrist_connection.thread, self.arm_connection.thread]
+
+    def cpu_seconds(self):
+        """
+        CPU time of the session's threads (DataStreamer worker and the two receive threads).
+        """
+        return sum(seconds for seconds in map(thread_cpu_seconds, self.threads()) if seconds is not None)
+
+    def status(self):
+        predictions = self.streamer.all_fatigue
+        return {
+            'session': self.name,
+            'fatigue': self.streamer.fatigue,
+            'prediction': None if not predictions or predictions[-1] is None else float(predictions[-1]),
+            'repetitions': len(predictions),
+            'wrist port': self.wrist_connection.address[1],
+            'arm port': self.arm_connection.address[1],
+            'received messages': self.wrist_connection.received_messages + self.arm_connection.received_messages,
+        }
+
+    def stats(self):
+        return {**self.status(), 'pipeline': self.streamer.pipeline_stats(), 'cpu seconds': self.cpu_seconds(),
+                'uptime seconds': time.time() - self.created}
+
+    def end(self):
+        self.wrist_connection.close()
+        self.arm_connection.close()
+        if self.folder_path is not None:
+            self.streamer.end(self.folder_path)
+        else:
+            self.streamer.stop()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.inference_server.handle_request(json.loads(line))
+            except Exception as error:
+                response = {'ok': False, 'error': f'{type(error).__name__}: {error}'}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class InferenceServer():
+    """
+    Headless host for many concurrent sessions sharing one model, loaded once by a ModelLoader.
+    Clients talk to it over a local TCP socket, one JSON object per line in each direction:
+        {"command": "register", "session": "station_1", "folder": null}  -> ports to send the IMU UDP feeds to
+        {"command": "fatigue", "session": "station_1"}                   -> live fatigue label and prediction
+        {"command": "sessions"} / {"command": "stats", "session": ...}   -> every session / pipeline and CPU metrics
+        {"command": "end", "session": "station_1"}                       -> stops it (and saves it with a folder)
+        {"command": "scheduler"}                                         -> batch sizes and added latency of the StepScheduler
+    With max_batch_size above 1, the LSTM steps of all sessions go through one StepScheduler, which batches
+    the steps that arrive within max_wait_ms of each other into one cell call.
+    Every response has "ok", and "error" when it is false.
+    """
+    def __init__(self, host='127.0.0.1', port=0, model_folder='./System/models', backend='keras', max_batch_size=16,
+                 max_wait_ms=2.0, **streamer_kwargs):
+        self.host = host
+        self.model_loader = ModelLoader(model_folder, backend)
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.step_scheduler = None
+        self.streamer_kwargs = streamer_kwargs
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.num_registered = 0
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.tcp_server = socketserver.ThreadingTCPServer((host, port), _RequestHandler)
+        self.tcp_server.daemon_threads = True
+        self.tcp_server.inference_server = self
+        self.address = self.tcp_server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.tcp_server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def serve_forever(self):
+        print(f'Inference server listening on {self.address[0]}:{self.address[1]}')
+        self.tcp_server.serve_forever()
+
+    def shutdown(self):
+        for name in list(self.sessions):
+            self.end(name)
+        self.tcp_server.shutdown()
+        self.tcp_server.server_close()
+        if self.step_scheduler is not None:
+            self.step_scheduler.close()
+
+    def handle_request(self, request):
+        command = request.get('command')
+        if command == 'register':
+            return {'ok': True, **self.register(request.get('session'), request.get('folder')).status()}
+        if command == 'fatigue':
+            return {'ok': True, **self._session(request).status()}
+        if command == 'stats':
+            return {'ok': True, **self._session(request).stats()}
+        if command == 'sessions':
+            return {'ok': True, 'sessions': [session.status() for session in list(self.sessions.values())]}
+        if command == 'scheduler':
+            return {'ok': True, **(self.step_scheduler.metrics() if self.step_scheduler is not None else {'batches': 0})}
+        if command == 'end':
+            self.end(request.get('session'))
+            return {'ok': True, 'session': request.get('session')}
+        return {'ok': False, 'error': f'Unknown command {command}. Must be register, fatigue, stats, sessions, scheduler or end'}
+
+    def register(self, name=None, folder_path=None):
+        with self.lock:
+            self.num_registered += 1
+            name = name or f'session_{self.num_registered:02d}'
+            if name in self.sessions:
+                raise ValueError(f'Session {name} already exists')
+            if self.step_scheduler is None and self.max_batch_size > 1:
+                self.step_scheduler = StepScheduler(self.model_loader.get()[0], self.max_batch_size, self.max_wait_ms)
+            session = Session(name, self.model_loader, folder_path, self.host, self.step_scheduler, **self.streamer_kwargs)
+            self.sessions[name] = session
+        return session
+
+    def end(self, name):
+        with self.lock:
+            session = self.sessions.pop(name, None)
+        if session is None:
+            raise KeyError(f'No session {name}')
+        session.end()
+
+    def _session(self, request):
+        name = request.get('session')
+        if name not in self.sessions:
+            raise KeyError(f'No session {name}')
+        return self.sessions[name]
+
+
+class InferenceClient():
+    """
+    Blocking client of an InferenceServer: request('fatigue', session='station_1') returns the response dict.
+    """
+    def __init__(self, address):
+        self.socket = socket.create_connection(address)
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, command, **fields):
+        self.file.write((json.dumps({'command': command, **fields}) + '\n').encode())
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def replay_to(folder_path, wrist_port, arm_port, host='127.0.0.1', rate=1.0):
+    """
+    Replays both devices of a recorded experiment as x-IMU3 UDP feeds to a session's ports.
+    Returns the two ReplayConnections, already playing from a shared start time.
+    """
+    feeds = []
+    start_time = time.perf_counter()
+    for side, port in [('wrist', wrist_port), ('arm', arm_port)]:
+        feed = ReplayConnection.from_experiment(folder_path, side, rate=rate)
+        sender = UdpSender((host, port))
+        feed.add_inertial_callback(sender)
+        feed.add_euler_angles_callback(sender)
+        feed.open(start_time)
+        feeds.append(feed)
+    return feeds
+
+def benchmark(folder_path, max_sessions, duration, rate, backend, max_batch_size=16, max_wait_ms=2.0):
+    """
+    Adds sessions one at a time, each fed by a replay of folder_path over UDP, and measures the resident memory
+    and the CPU time of the session threads over `duration` seconds after each addition.
+    """
+    server = InferenceServer(backend=backend, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    server.start()
+    client = InferenceClient(server.address)
+    server.model_loader.get()
+    baseline_rss = current_rss_mb()
+    print(f'model loaded, {baseline_rss:.0f} MB resident')
+    feeds, rows = [], []
+    for num_sessions in range(1, max_sessions + 1):
+        status = client.request('register')
+        feeds += replay_to(folder_path, status['wrist port'], status['arm port'], rate=rate)
+        sessions = list(server.sessions.values())
+        cpu_before = [session.cpu_seconds() for session in sessions]
+        process_before = time.process_time()
+        time.sleep(duration)
+        session_cpu = [session.cpu_seconds() - before for session, before in zip(sessions, cpu_before)]
+        rss = current_rss_mb()
+        rows.append({
+            'sessions': num_sessions,
+            'rss mb': rss,
+            'rss per session mb': (rss - baseline_rss) / num_sessions,
+            'cpu per session %': 100 * sum(session_cpu) / num_sessions / duration,
+            'process cpu %': 100 * (time.process_time() - process_before) / duration,
+            'repetitions': sum(len(session.streamer.all_fatigue) for session in sessions),
+        })
+        print(', '.join(f'{key} {value:.1f}' if isinstance(value, float) else f'{key} {value}' for key, value in rows[-1].items()))
+    for feed in feeds:
+        feed.close()
+    for status in client.request('sessions')['sessions']:
+        print(f"{status['session']}: {status['fatigue']}, {status['repetitions']} repetitions, "
+              f"{status['received messages']} messages")
+    print(f"LSTM step scheduler: {client.request('scheduler')}")
+    client.close()
+    server.shutdown()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless fatigue inference for many stations, with one shared model')
+    parser.add_argument('command', choices=['serve', 'replay', 'benchmark'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--model-folder', default='./System/models')
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='keras')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='LSTM steps batched across sessions, 1 to step each alone')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='longest a step waits for others to batch with')
+    parser.add_argument('--experiment', default='./Data/Participants/individual_00/experiment_1',
+                        help='replay and benchmark: recording to feed the sessions with')
+    parser.add_argument('--rate', type=float, default=1.0, help='replay and benchmark: playback speed')
+    parser.add_argument('--sessions', type=int, default=4, help='benchmark: number of sessions to add')
+    parser.add_argument('--duration', type=float, default=10.0, help='benchmark: seconds measured after each addition')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = InferenceServer(args.host, args.port, args.model_folder, args.backend, args.max_batch_size, args.max_wait_ms)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == 'replay':
+        # registers a session on a running server and plays a recording into it, printing its fatigue
+        client = InferenceClient((args.host, args.port))
+        status = client.request('register')
+        if not status['ok']:
+            raise SystemExit(status['error'])
+        feeds = replay_to(args.experiment, status['wrist port'], status['arm port'], args.host, args.rate)
+        while any(feed.is_playing() for feed in feeds):
+            time.sleep(1)
+            print(client.request('fatigue', session=status['session']))
+        client.request('end', session=status['session'])
+        client.close()
+    else:
+        benchmark(args.experiment, args.sessions, args.duration, args.rate, args.backend, args.max_batch_size, args.max_wait_ms)
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+import joblib
+import numpy as np
+from NumpyLSTM import NumpyLSTM
+from IncrementalRNN import IncrementalRNN
+from FeaturePlan import load_feature_manifest
+
+def load_rnn_model(model_folder, backend='keras'):
+    """
+    Loads the fatigue RNN with the given backend.
+    'keras' loads rnn.keras through TensorFlow; 'numpy' loads the rnn.npz export and never imports TensorFlow.
+    """
+    if backend == 'numpy':
+        npz_path = f'{model_folder}/rnn.npz'
+        if not os.path.exists(npz_path):
+            NumpyLSTM.from_keras(f'{model_folder}/rnn.keras').export_npz(npz_path)
+        return NumpyLSTM.load(npz_path)
+    if backend == 'keras':
+        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+        from tensorflow.keras.models import load_model
+        return load_model(f'{model_folder}/rnn.keras')
+    raise ValueError(f'Unknown RNN backend {backend}. Must be keras or numpy')
+
+def model_num_features(model):
+    return model.num_features if hasattr(model, 'num_features') else model.input_shape[-1]
+
+def load_model_features(model_folder, model):
+    """
+    The feature manifest saved with the model, checked against the number of inputs the model takes.
+    """
+    manifest_path = f'{model_folder}/features.json'
+    manifest = load_feature_manifest(manifest_path)
+    if len(manifest['feature_indices']) != model_num_features(model):
+        raise ValueError(f"{manifest_path} lists {len(manifest['feature_indices'])} features but the RNN in {model_folder} "
+                         f"takes {model_num_features(model)}")
+    return manifest
+
+def warm_up(model):
+    """
+    Runs one dummy prediction through both inference paths of DataStreamer (model.predict and a single
+    IncrementalRNN step), so graph tracing and first-call allocations happen before the first repetition.
+    """
+    dummy = np.zeros((1, 1, model_num_features(model)), dtype='float32')
+    model.predict(dummy, verbose=0)
+    IncrementalRNN(model).step(dummy[0, 0])
+
+class ModelLoader():
+    """
+    Loads the RNN, the scaler and the feature manifest on a background thread, started as soon as the app launches, so the
+    import of TensorFlow, the model load and the warm-up overlap with the setup pages.
+    get() blocks only if loading has not finished yet, and re-raises any error from the thread.
+    """
+    def __init__(self, model_folder='./System/models', backend='keras'):
+        self.model_folder = model_folder
+        self.backend = backend
+        self.rnn_model = None
+        self.scaler = None
+        self.feature_manifest = None
+        self.error = None
+        self.load_time = None
+        self.warm_up_time = None
+        self.thread = threading.Thread(target=self._load, daemon=True)
+        self.thread.start()
+
+    def _load(self):
+        try:
+            start = time.perf_counter()
+            self.rnn_model = load_rnn_model(self.model_folder, self.backend)
+            self.scaler = joblib.load(f'{self.model_folder}/scaler.pkl')
+            self.feature_manifest = load_model_features(self.model_folder, self.rnn_model)
+            loaded = time.perf_counter()
+            warm_up(self.rnn_model)
+            self.load_time = loaded - start
+            self.warm_up_time = time.perf_counter() - loaded
+            print(f'Models loaded in {self.load_time:.2f} s, warmed up in {self.warm_up_time:.2f} s ({self.backend} backend)')
+        except Exception as error:
+            self.error = error
+
+    def is_ready(self):
+        return not self.thread.is_alive()
+
+    def get(self, timeout=None):
+        """
+        Returns (rnn_model, scaler, feature_manifest), waiting for the background load if needed.
+        """
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            raise TimeoutError(f'Models in {self.model_folder} are still loading')
+        if self.error is not None:
+            raise self.error
+        return self.rnn_model, self.scaler, self.feature_manifest
@@ -0,0 +1,160 @@
+import argparse
+import io
+import json
+import os
+import zipfile
+import numpy as np
+
+class NumpyLSTM():
+    """
+    Inference-only NumPy copy of the Masking -> LSTM -> Dense model trained in train_rnn.ipynb.
+    Weights are read once from an .npz export of rnn.keras, so TensorFlow never has to be imported.
+    """
+    def __init__(self, kernel, recurrent_kernel, bias, dense_kernel, dense_bias, mask_value=-1.0):
+        self.kernel = np.asarray(kernel, dtype='float32')
+        self.recurrent_kernel = np.asarray(recurrent_kernel, dtype='float32')
+        self.bias = np.asarray(bias, dtype='float32')
+        self.dense_kernel = np.asarray(dense_kernel, dtype='float32')
+        self.dense_bias = np.asarray(dense_bias, dtype='float32')
+        self.mask_value = None if mask_value is None or np.isnan(mask_value) else float(mask_value)
+        self.units = self.recurrent_kernel.shape[0]
+        self.num_features = self.kernel.shape[0]
+
+    @classmethod
+    def load(cls, npz_path):
+        """
+        Loads the weights written by export_npz.
+        """
+        with np.load(npz_path) as weights:
+            return cls(weights['kernel'], weights['recurrent_kernel'], weights['bias'],
+                       weights['dense_kernel'], weights['dense_bias'], float(weights['mask_value']))
+
+    @classmethod
+    def from_keras(cls, keras_path):
+        """
+        Reads the weights straight out of a .keras archive with h5py, without importing TensorFlow.
+        """
+        import h5py
+        with zipfile.ZipFile(keras_path) as archive:
+            config = json.loads(archive.read('config.json'))
+            weights_file = io.BytesIO(archive.read('model.weights.h5'))
+
+        mask_value = None
+        for layer in config['config']['layers']:
+            layer_config = layer['config']
+            if layer['class_name'] == 'Masking':
+                mask_value = layer_config['mask_value']
+            if layer['class_name'] == 'LSTM':
+                if layer_config['activation'] != 'tanh' or layer_config['recurrent_activation'] != 'sigmoid':
+                    raise ValueError('only tanh/sigmoid LSTM layers are supported')
+
+        with h5py.File(weights_file, 'r') as f:
+            layer_names = list(f['layers'].keys())
+            lstm_name = next(name for name in layer_names if name.startswith('lstm'))
+            dense_name = next(name for name in layer_names if name.startswith('dense'))
+            cell = f['layers'][lstm_name]['cell']['vars']
+            dense = f['layers'][dense_name]['vars']
+            return cls(cell['0'][()], cell['1'][()], cell['2'][()], dense['0'][()], dense['1'][()],
+                       mask_value)
+
+    def export_npz(self, npz_path):
+        np.savez(npz_path, kernel=self.kernel, recurrent_kernel=self.recurrent_kernel, bias=self.bias,
+                 dense_kernel=self.dense_kernel, dense_bias=self.dense_bias,
+                 mask_value=np.nan if self.mask_value is None else self.mask_value)
+
+    def zero_states(self, batch_size=1):
+        return [np.zeros((batch_size, self.units), dtype='float32'), np.zeros((batch_size, self.units), dtype='float32')]
+
+    def lstm_step(self, x, states):
+        """
+        One LSTM timestep for a (batch, features) input. Returns (h, [h, c]) like a Keras LSTMCell.
+        """
+        h, c = states
+        z = x @ self.kernel + h @ self.recurrent_kernel + self.bias
+        return self._gates(z, c)
+
+    def output(self, h):
+        return h @ self.dense_kernel + self.dense_bias
+
+    def predict(self, X, verbose=0):
+        """
+        Forward pass over a (batch, timesteps, features) array, returning (batch, timesteps, 1) like model.predict.
+        The input projection is done for every timestep in one matmul, leaving only the recurrence in the loop.
+        """
+        X = np.asarray(X, dtype='float32')
+        if X.ndim == 2:
+            X = X[np.newaxis]
+        batch_size, timesteps, _ = X.shape
+        if self.mask_value is None:
+            mask = np.ones((batch_size, timesteps), dtype=bool)
+        else:
+            mask = np.any(X != self.mask_value, axis=-1)
+
+        projected = X @ self.kernel + self.bias
+        h, c = self.zero_states(batch_size)
+        hidden = np.empty((batch_size, timesteps, self.units), dtype='float32')
+        for t in range(timesteps):
+            new_h, (_, new_c) = self._gates(projected[:, t] + h @ self.recurrent_kernel, c)
+            # masked timesteps carry the previous state and output forward, as in the Masking layer
+            keep = mask[:, t, np.newaxis]
+            h = np.where(keep, new_h, h)
+            c = np.where(keep, new_c, c)
+            hidden[:, t] = h
+        return self.output(hidden)
+
+    def _gates(self, z, c):
+        i, f, g, o = np.split(z, 4, axis=-1)
+        c = self._sigmoid(f) * c + self._sigmoid(i) * np.tanh(g)
+        h = self._sigmoid(o) * np.tanh(c)
+        return h, [h, c]
+
+    def _sigmoid(self, x):
+        return 1 / (1 + np.exp(-x))
+
+
+def check_parity(keras_path, npz_path, features_folder, scaler_path, rnn_indices, tolerance=1e-4):
+    """
+    Compares the NumPy forward pass against the Keras model on every experiment in the features folder.
+    """
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    import joblib
+    from tensorflow.keras.models import load_model
+    keras_model = load_model(keras_path)
+    numpy_model = NumpyLSTM.load(npz_path)
+    scaler = joblib.load(scaler_path)
+
+    max_error = 0
+    num_experiments = 0
+    for individual_folder in sorted(os.listdir(features_folder)):
+        if 'individual' not in individual_folder:
+            continue
+        for experiment_folder in sorted(os.listdir(f'{features_folder}/{individual_folder}')):
+            X = np.load(f'{features_folder}/{individual_folder}/{experiment_folder}/X.npy', allow_pickle=True)
+            if len(X) == 0:
+                continue
+            X = scaler.transform(X)[:, rnn_indices][np.newaxis]
+            expected = keras_model.predict(X, verbose=0)
+            actual = numpy_model.predict(X)
+            max_error = max(max_error, float(np.max(np.abs(expected - actual))))
+            num_experiments += 1
+    print(f'{num_experiments} experiments, max abs difference {max_error:.2e}')
+    return max_error <= tolerance
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export rnn.keras to .npz and check the NumPy backend against Keras.')
+    parser.add_argument('command', choices=['export', 'check'])
+    parser.add_argument('--model-folder', default='./System/models')
+    parser.add_argument('--features-folder', default='./Data/Features Data')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        NumpyLSTM.from_keras(f'{args.model_folder}/rnn.keras').export_npz(f'{args.model_folder}/rnn.npz')
+        print(f'Saved {args.model_folder}/rnn.npz')
+    else:
+        from FeaturePlan import load_feature_manifest
+        rnn_indices = load_feature_manifest(f'{args.model_folder}/features.json')['feature_indices']
+        ok = check_parity(f'{args.model_folder}/rnn.keras', f'{args.model_folder}/rnn.npz',
+                          args.features_folder, f'{args.model_folder}/scaler.pkl', rnn_indices)
+        print('parity OK' if ok else 'parity FAILED')
+        raise SystemExit(0 if ok else 1)
@@ -0,0 +1,103 @@
+import time
+from collections import deque
+import numpy as np
+from PySide6.QtCore import Qt, QPointF, QTimer
+from PySide6.QtGui import QColor, QPainter, QPen, QPolygonF
+from PySide6.QtWidgets import QWidget
+from PitchTrace import PitchTrace, min_max_decimate
+
+class PitchPlot(QWidget):
+    """
+    Live plot of the arm minus wrist pitch DataStreamer detects repetitions on: the last window_seconds of it,
+    the detected peaks as dots, repetition boundaries as vertical lines and the peak threshold as a dashed line.
+    Pass self.trace to DataStreamer(pitch_trace=...). The window is min/max decimated to one bucket per pixel
+    column, so a frame costs the same at any point of a session. A timer checks the trace refresh_hz times a
+    second and repaints only if it changed.
+    """
+    def __init__(self, window_seconds=20, refresh_hz=20, sample_rate_hz=50, threshold=60, parent=None):
+        super().__init__(parent)
+        self.sample_rate_hz = sample_rate_hz
+        self.threshold = threshold
+        self.trace = PitchTrace(int(window_seconds * sample_rate_hz))
+        self.drawn_version = None
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._refresh)
+        self.set_refresh_rate(refresh_hz)
+        # paint durations and the intervals between frames, in seconds
+        self.frame_times = deque(maxlen=2000)
+        self.frame_intervals = deque(maxlen=2000)
+        self.last_frame = None
+        self.setMinimumSize(400, 200)
+
+    def set_refresh_rate(self, refresh_hz):
+        self.timer.setInterval(max(1, int(round(1000 / refresh_hz))))
+
+    def set_window(self, window_seconds):
+        self.trace.resize(int(window_seconds * self.sample_rate_hz))
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def _refresh(self):
+        if self.trace.version != self.drawn_version:
+            self.update()
+
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        first, values, peaks, repetitions, version = self.trace.snapshot()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('white'))
+        width, height = self.width(), self.height()
+        if len(values) > 1:
+            window = self.trace.window_samples
+            low = min(np.nanmin(values), self.threshold) - 5
+            high = max(np.nanmax(values), self.threshold) + 5
+            to_x = lambda index: (index - first) * (width - 1) / max(window - 1, 1)
+            to_y = lambda value: (high - value) * (height - 1) / (high - low)
+
+            painter.setPen(QPen(QColor('lightgray'), 1))
+            for start_index, end_index in repetitions:
+                for index in (start_index, end_index):
+                    if index >= first:
+                        painter.drawLine(QPointF(to_x(index), 0), QPointF(to_x(index), height))
+            painter.setPen(QPen(QColor('gray'), 1, Qt.PenStyle.DashLine))
+            painter.drawLine(QPointF(0, to_y(self.threshold)), QPointF(width, to_y(self.threshold)))
+
+            positions, decimated = min_max_decimate(values, max(1, width))
+            painter.setPen(QPen(QColor('#5900FF'), 1.5))
+            painter.drawPolyline(QPolygonF([QPointF(to_x(first + position), to_y(value))
+                                            for position, value in zip(positions, decimated)]))
+
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor('red'))
+            for peak in peaks:
+                if first <= peak < first + len(values):
+                    painter.drawEllipse(QPointF(to_x(peak), to_y(values[peak - first])), 4, 4)
+        painter.end()
+        self.drawn_version = version
+
+        end = time.perf_counter()
+        self.frame_times.append(end - start)
+        if self.last_frame is not None:
+            self.frame_intervals.append(end - self.last_frame)
+        self.last_frame = end
+
+    def stats(self):
+        """
+        Paint time percentiles and the achieved frame rate over the recent frames, plus the cost of feeding the trace
+        on the DataStreamer worker.
+        """
+        frame_ms = np.array(self.frame_times) * 1000
+        if len(frame_ms) == 0:
+            return {'frames': 0, **self.trace.stats()}
+        return {
+            'frames': len(frame_ms),
+            'paint mean ms': float(np.mean(frame_ms)),
+            'paint p95 ms': float(np.percentile(frame_ms, 95)),
+            'paint max ms': float(np.max(frame_ms)),
+            'fps': float(1 / np.mean(self.frame_intervals)) if self.frame_intervals else 0.0,
+            **self.trace.stats(),
+        }
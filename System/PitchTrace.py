@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+
+def min_max_decimate(values, num_buckets):
+    """
+    Reduces values to at most 2 * num_buckets points that keep their visible envelope: the minimum and the
+    maximum of each of num_buckets equal runs of samples, in the order they occur. Returns (positions, values).
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) <= 2 * num_buckets:
+        return np.arange(len(values)), values
+    bucket_size = -(-len(values) // num_buckets)
+    # the last bucket is padded with its last sample, which repeats a point but never adds one
+    padded = np.concatenate([values, np.full(bucket_size * num_buckets - len(values), values[-1])]).reshape(num_buckets, bucket_size)
+    starts = np.arange(num_buckets)[:, np.newaxis] * bucket_size
+    extremes = np.sort(np.stack([np.argmin(padded, axis=1), np.argmax(padded, axis=1)], axis=1), axis=1)
+    positions = np.minimum((starts + extremes).ravel(), len(values) - 1)
+    return positions, values[positions]
+
+
+class PitchTrace():
+    """
+    The most recent window_samples arm minus wrist pitch samples, with the peaks and repetitions inside them,
+    written by the DataStreamer worker and read by a plot on the UI thread.
+    Samples go into a ring buffer under a short lock, and snapshot() copies at most window_samples values,
+    so reading costs the same however long the session has run. Sample indices are those of DataStreamer.
+    """
+    def __init__(self, window_samples=1000):
+        self.window_samples = window_samples
+        self.ring = np.full(window_samples, np.nan)
+        self.num_samples = 0
+        # first sample index the ring holds, which moves forward when the window is resized
+        self.first_held = 0
+        self.peaks = deque()
+        self.repetitions = deque()
+        # bumped on every change, so a reader can skip redrawing an unchanged trace
+        self.version = 0
+        self.lock = threading.Lock()
+        self.append_seconds = 0.0
+        self.num_appends = 0
+
+    def append(self, index, value):
+        start = time.perf_counter()
+        with self.lock:
+            self.ring[index % self.window_samples] = value
+            self.num_samples = index + 1
+            self.version += 1
+        self.append_seconds += time.perf_counter() - start
+        self.num_appends += 1
+
+    def add_peak(self, index, replace_last=False):
+        """
+        Marks a peak; replace_last moves the latest peak instead, as DataStreamer does when it merges two.
+        """
+        with self.lock:
+            if replace_last and self.peaks:
+                self.peaks[-1] = index
+            else:
+                self.peaks.append(index)
+            self._trim()
+            self.version += 1
+
+    def add_repetition(self, start, end):
+        with self.lock:
+            self.repetitions.append((start, end))
+            self._trim()
+            self.version += 1
+
+    def snapshot(self):
+        """
+        (first sample index, pitch values in order, peaks, repetitions, version) of the current window, as copies.
+        """
+        with self.lock:
+            self._trim()
+            values = self._ordered()
+            return self.num_samples - len(values), values, list(self.peaks), list(self.repetitions), self.version
+
+    def resize(self, window_samples):
+        """
+        Changes the window length, keeping the most recent samples that fit.
+        """
+        with self.lock:
+            values = self._ordered()[-window_samples:]
+            self.window_samples = window_samples
+            self.ring = np.full(window_samples, np.nan)
+            self.first_held = self.num_samples - len(values)
+            for offset, value in enumerate(values):
+                self.ring[(self.first_held + offset) % window_samples] = value
+            self._trim()
+            self.version += 1
+
+    def _ordered(self):
+        """
+        The held samples, oldest first: the last window_samples, or fewer right after a start or a resize.
+        """
+        count = min(self.num_samples - self.first_held, self.window_samples)
+        positions = np.arange(self.num_samples - count, self.num_samples) % self.window_samples
+        return self.ring[positions]
+
+    def _trim(self):
+        first = self.num_samples - self.window_samples
+        while self.peaks and self.peaks[0] < first:
+            self.peaks.popleft()
+        while self.repetitions and self.repetitions[0][1] < first:
+            self.repetitions.popleft()
+
+    def stats(self):
+        return {'appends': self.num_appends,
+                'mean append us': 1e6 * self.append_seconds / self.num_appends if self.num_appends else 0.0}
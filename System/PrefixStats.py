@@ -0,0 +1,198 @@
+import numpy as np
+
+# statistics 0-8 of FeaturePlan.STATISTICS, which only need power sums, extremes and the lag 1 cross product
+NUM_MOMENT_STATISTICS = 9
+
+class PrefixStats():
+    """
+    Running per-channel prefix sums of x, x^2, x^3, x^4 and x_i * x_(i+1), so the power sums of any [start, end]
+    interval cost O(1) per channel. The maximum and minimum are one vectorised reduction over the held rows.
+
+    With window > 1 the statistics are those of the segment smoothed with a trailing rolling mean that restarts
+    at the segment start (as DataStreamer.smoothen does with min_periods=1). The prefix sums hold the smoothed
+    signal of the whole stream, and the first window - 1 rows of each segment, which only see part of the window,
+    are swapped for their segment-local values.
+
+    Sums are taken around the first value of each channel to limit cancellation. Results match the direct
+    NumPy/SciPy expressions to floating point round-off, not bit for bit.
+    """
+    def __init__(self, num_channels, window=1, initial_capacity=4096):
+        self.num_channels = num_channels
+        self.window = window
+        self.initial_capacity = initial_capacity
+        self.reset(0)
+
+    def reset(self, start_row):
+        """
+        Forgets every row and restarts the stream at start_row, e.g. when earlier rows will never be queried.
+        """
+        self.offset = start_row
+        self.length = start_row
+        self.reference = None
+        capacity = self.initial_capacity
+        self.raw = np.empty((capacity, self.num_channels))
+        self.smoothed = np.empty((capacity, self.num_channels))
+        # power_sums[k][i] = sum of (smoothed - reference)^(k+1) over the rows before offset + i
+        self.power_sums = np.zeros((4, capacity + 1, self.num_channels))
+        # cross_sums[i] = sum of the lag 1 products (x_(j-1) - reference) * (x_j - reference) for j < offset + i
+        self.cross_sums = np.zeros((capacity + 1, self.num_channels))
+
+    def __len__(self):
+        return self.length
+
+    def append(self, rows):
+        """
+        Appends rows (num_rows, num_channels) of raw values to the stream.
+        """
+        rows = np.asarray(rows, dtype=float).reshape(-1, self.num_channels)
+        if len(rows) == 0:
+            return
+        if self.reference is None:
+            self.reference = rows[0].copy()
+        first = self.length - self.offset
+        last = first + len(rows)
+        self._reserve(last)
+        self.raw[first:last] = rows
+
+        # trailing rolling mean over the whole stream
+        context = max(0, first - self.window + 1)
+        cumulative = np.cumsum(np.vstack((np.zeros((1, self.num_channels)), self.raw[context:last])), axis=0)
+        positions = np.arange(first, last)
+        lower = np.maximum(positions - self.window + 1, 0)
+        self.smoothed[first:last] = ((cumulative[positions - context + 1] - cumulative[lower - context])
+                                     / (positions - lower + 1)[:, np.newaxis])
+
+        centered = self.smoothed[first:last] - self.reference
+        power = centered.copy()
+        for k in range(4):
+            self.power_sums[k, first + 1:last + 1] = self.power_sums[k, first] + np.cumsum(power, axis=0)
+            power *= centered
+        if first > 0:
+            previous = self.smoothed[first - 1:last - 1] - self.reference
+        else:
+            previous = np.vstack((np.zeros((1, self.num_channels)), centered[:-1]))
+        cross = previous * centered
+        self.cross_sums[first + 1:last + 1] = self.cross_sums[first] + np.cumsum(cross, axis=0)
+        self.length += len(rows)
+
+    def moments(self, start, end):
+        """
+        Statistics 0-8 (mean, std, skewness, kurtosis, range, max, min, rms, lag 1 autocorrelation) of rows
+        start to end inclusive, as an array (num_channels, 9).
+        """
+        if start < self.offset or end >= self.length:
+            raise IndexError(f'rows {start} to {end} are not held (held: {self.offset} to {self.length - 1})')
+        n = end - start + 1
+        num_local = min(self.window - 1, n)
+        local = self._local_smoothed(start, num_local) - self.reference
+        global_start = start + num_local
+
+        sums = [self._range_sum(self.power_sums[k], global_start, end + 1) + np.sum(local ** (k + 1), axis=0)
+                for k in range(4)]
+        mean_centered = sums[0] / n
+        m2 = sums[1] / n - mean_centered**2
+        m3 = sums[2] / n - 3 * mean_centered * sums[1] / n + 2 * mean_centered**3
+        m4 = sums[3] / n - 4 * mean_centered * sums[2] / n + 6 * mean_centered**2 * sums[1] / n - 3 * mean_centered**4
+        m2 = np.maximum(m2, 0)
+        degenerate = m2 <= (np.finfo(float).eps * np.maximum(np.abs(mean_centered + self.reference), 1))**2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            skewness = np.where(degenerate, np.nan, m3 / m2**1.5)
+            kurt = np.where(degenerate, np.nan, m4 / m2**2 - 3)
+
+        maximum, minimum = self._extremes(start, end, local + self.reference)
+        mean = mean_centered + self.reference
+        raw_square_sum = sums[1] + 2 * self.reference * sums[0] + n * self.reference**2
+
+        statistics = np.empty((self.num_channels, NUM_MOMENT_STATISTICS))
+        statistics[:, 0] = mean
+        statistics[:, 1] = np.sqrt(m2)
+        statistics[:, 2] = skewness
+        statistics[:, 3] = kurt
+        statistics[:, 4] = maximum - minimum
+        statistics[:, 5] = maximum
+        statistics[:, 6] = minimum
+        statistics[:, 7] = np.sqrt(np.maximum(raw_square_sum, 0) / n)
+        statistics[:, 8] = self._autocorrelation(start, end, local, global_start, sums)
+        return statistics
+
+    def discard_before(self, row):
+        """
+        Drops the rows before row. Prefix sums are only ever differenced, so the kept part stays valid.
+        """
+        row = min(max(row, self.offset), self.length)
+        shift = row - self.offset
+        if shift == 0:
+            return
+        kept = self.length - row
+        self.raw[:kept] = self.raw[shift:shift + kept].copy()
+        self.smoothed[:kept] = self.smoothed[shift:shift + kept].copy()
+        self.power_sums[:, :kept + 1] = self.power_sums[:, shift:shift + kept + 1].copy()
+        self.cross_sums[:kept + 1] = self.cross_sums[shift:shift + kept + 1].copy()
+        self.offset = row
+
+    def _range_sum(self, prefix, start, stop):
+        if stop <= start:
+            return np.zeros(self.num_channels)
+        return prefix[stop - self.offset] - prefix[start - self.offset]
+
+    def _local_smoothed(self, start, num_local):
+        """
+        The first num_local smoothed values of a segment starting at start, averaged over the segment's rows only.
+        """
+        rows = self.raw[start - self.offset:start - self.offset + num_local]
+        return np.cumsum(rows, axis=0) / np.arange(1, num_local + 1)[:, np.newaxis]
+
+    def _extremes(self, start, end, local):
+        global_start = start + len(local)
+        if global_start > end:
+            return np.max(local, axis=0), np.min(local, axis=0)
+        smoothed = self.smoothed[global_start - self.offset:end + 1 - self.offset]
+        maximum, minimum = np.max(smoothed, axis=0), np.min(smoothed, axis=0)
+        if len(local) > 0:
+            maximum = np.maximum(maximum, np.max(local, axis=0))
+            minimum = np.minimum(minimum, np.min(local, axis=0))
+        return maximum, minimum
+
+    def _autocorrelation(self, start, end, local, global_start, sums):
+        """
+        Pearson correlation of y[:-1] and y[1:] from the power sums and the lag 1 cross product sum.
+        """
+        n = end - start + 1
+        if n < 3:
+            return np.full(self.num_channels, np.nan)
+        first = local[0] if len(local) > 0 else self.smoothed[start - self.offset] - self.reference
+        last = self.smoothed[end - self.offset] - self.reference if global_start <= end else local[-1]
+
+        # pairs inside the local head, the pair joining head and body, then the pairs inside the body
+        cross = np.sum(local[:-1] * local[1:], axis=0)
+        if len(local) > 0 and global_start <= end:
+            cross += local[-1] * (self.smoothed[global_start - self.offset] - self.reference)
+        if global_start < end:
+            cross += self._range_sum(self.cross_sums, global_start + 1, end + 1)
+
+        m = n - 1
+        sum_a, sum_b = sums[0] - last, sums[0] - first
+        square_a, square_b = sums[1] - last**2, sums[1] - first**2
+        covariance = cross - sum_a * sum_b / m
+        variance_a = square_a - sum_a**2 / m
+        variance_b = square_b - sum_b**2 / m
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return covariance / np.sqrt(variance_a * variance_b)
+
+    def _reserve(self, num_rows):
+        capacity = self.raw.shape[0]
+        if num_rows <= capacity:
+            return
+        while capacity < num_rows:
+            capacity *= 2
+        for name in ['raw', 'smoothed']:
+            grown = np.empty((capacity, self.num_channels))
+            grown[:self.length - self.offset] = getattr(self, name)[:self.length - self.offset]
+            setattr(self, name, grown)
+        power_sums = np.zeros((4, capacity + 1, self.num_channels))
+        power_sums[:, :self.power_sums.shape[1]] = self.power_sums
+        self.power_sums = power_sums
+        cross_sums = np.zeros((capacity + 1, self.num_channels))
+        cross_sums[:self.cross_sums.shape[0]] = self.cross_sums
+        self.cross_sums = cross_sums
+
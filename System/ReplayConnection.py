@@ -0,0 +1,226 @@
+import random
+import threading
+import time
+from ColumnarIMU import read_imu_data
+
+class EulerAnglesMessage():
+    """
+    Same fields as ximu3.EulerAnglesMessage that DataStreamer reads. timestamp is in microseconds.
+    """
+    __slots__ = ('timestamp', 'roll', 'pitch', 'yaw')
+
+    def __init__(self, timestamp, roll, pitch, yaw):
+        self.timestamp = timestamp
+        self.roll = roll
+        self.pitch = pitch
+        self.yaw = yaw
+
+class InertialMessage():
+    """
+    Same fields as ximu3.InertialMessage that DataStreamer reads. timestamp is in microseconds.
+    """
+    __slots__ = ('timestamp', 'gyroscope_x', 'gyroscope_y', 'gyroscope_z',
+                 'accelerometer_x', 'accelerometer_y', 'accelerometer_z')
+
+    def __init__(self, timestamp, gyroscope_x, gyroscope_y, gyroscope_z, accelerometer_x, accelerometer_y, accelerometer_z):
+        self.timestamp = timestamp
+        self.gyroscope_x = gyroscope_x
+        self.gyroscope_y = gyroscope_y
+        self.gyroscope_z = gyroscope_z
+        self.accelerometer_x = accelerometer_x
+        self.accelerometer_y = accelerometer_y
+        self.accelerometer_z = accelerometer_z
+
+
+class ReplayPace():
+    """
+    Keeps the devices of one replay within lead_ms of recording time of each other. Played as fast as possible,
+    one device's thread can otherwise run seconds ahead of the other, which a real pair of devices never does;
+    here the device that is ahead waits for the one behind instead.
+    """
+    def __init__(self, lead_ms=100):
+        self.lead_ms = lead_ms
+        self.condition = threading.Condition()
+        # recording time (ms) each playing device has reached
+        self.positions = {}
+
+    def start(self, connection):
+        """
+        Registers connection as playing; register every device before opening any, so none starts out ahead.
+        """
+        with self.condition:
+            self.positions.setdefault(connection, float('-inf'))
+
+    def wait(self, connection, timestamp_ms):
+        """
+        Marks connection as at timestamp_ms, then blocks until no playing device is more than lead_ms behind it.
+        """
+        with self.condition:
+            self.positions[connection] = timestamp_ms
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: connection.stop_event.is_set()
+                                    or timestamp_ms <= min(self.positions.values()) + self.lead_ms)
+
+    def stop(self, connection):
+        with self.condition:
+            self.positions.pop(connection, None)
+            self.condition.notify_all()
+
+
+class ReplayConnection():
+    """
+    Stand-in for a ximu3.Connection that replays one device ('wrist' or 'arm') of a recorded imu_data.csv.
+    Exposes the add_euler_angles_callback / add_inertial_callback surface used by DataStreamer.start().
+    Playback runs on its own thread from open() until the recording ends or close() is called.
+    - rate: playback speed relative to real time (1 = real time, N = N times faster, None = as fast as possible)
+    - jitter_ms: each message is delivered up to this many milliseconds late (order is preserved)
+    - packet_loss: probability that any single message is dropped
+    - pace: a ReplayPace shared with the other device, so neither runs ahead of the other
+    """
+    def __init__(self, timestamps_ms, euler_angles, inertial, rate=1.0, jitter_ms=0.0, packet_loss=0.0, seed=None, pace=None):
+        self.timestamps_ms = list(timestamps_ms)
+        self.euler_angles = euler_angles
+        self.inertial = inertial
+        self.rate = rate
+        self.jitter_ms = jitter_ms
+        self.packet_loss = packet_loss
+        self.random = random.Random(seed)
+        self.pace = pace
+        self.euler_angles_callbacks = []
+        self.inertial_callbacks = []
+        self.sent_messages = 0
+        self.dropped_messages = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def from_experiment(cls, folder_path, side, **kwargs):
+        """
+        Builds the replay of the 'wrist' or 'arm' device from Data/Participants/individual_xx/experiment_y.
+        """
+        device = side.capitalize()
+        euler_columns = [f'{device} Roll (deg)', f'{device} Pitch (deg)', f'{device} Yaw (deg)']
+        inertial_columns = [f'{device} Gyroscope X (deg/s)', f'{device} Gyroscope Y (deg/s)', f'{device} Gyroscope Z (deg/s)',
+                            f'{device} Accelerometer X (g)', f'{device} Accelerometer Y (g)', f'{device} Accelerometer Z (g)']
+        # only this device's channels are decompressed when the experiment has been converted by ColumnarIMU
+        imu_df = read_imu_data(folder_path, euler_columns + inertial_columns)
+        euler_angles = imu_df[euler_columns].values.tolist()
+        inertial = imu_df[inertial_columns].values.tolist()
+        return cls(imu_df.index, euler_angles, inertial, **kwargs)
+
+    def add_euler_angles_callback(self, callback):
+        self.euler_angles_callbacks.append(callback)
+
+    def add_inertial_callback(self, callback):
+        self.inertial_callbacks.append(callback)
+
+    def open(self, start_time=None):
+        """
+        Starts playback. Devices opened with the same start_time (a time.perf_counter() value) stay in step.
+        """
+        self.stop_event.clear()
+        if self.pace is not None:
+            self.pace.start(self)
+        start_time = time.perf_counter() if start_time is None else start_time
+        self.thread = threading.Thread(target=self._play, args=(start_time,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.pace is not None:
+            self.pace.stop(self)
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def join(self, timeout=None):
+        """
+        Waits until the whole recording has been played.
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def is_playing(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _play(self, start_time):
+        try:
+            self._play_messages(start_time)
+        finally:
+            if self.pace is not None:
+                self.pace.stop(self)
+
+    def _play_messages(self, start_time):
+        first_timestamp_ms = self.timestamps_ms[0] if self.timestamps_ms else 0
+        last_delivery = start_time
+        for timestamp_ms, euler_angles, inertial in zip(self.timestamps_ms, self.euler_angles, self.inertial):
+            if self.stop_event.is_set():
+                return
+            if self.rate is not None:
+                delivery = start_time + (timestamp_ms - first_timestamp_ms) / 1000 / self.rate
+                if self.jitter_ms > 0:
+                    delivery += self.random.uniform(0, self.jitter_ms) / 1000
+                # jitter delays a message but never reorders it
+                last_delivery = max(last_delivery, delivery)
+                delay = last_delivery - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if self.pace is not None:
+                self.pace.wait(self, timestamp_ms)
+
+            timestamp_us = int(round(timestamp_ms * 1000))
+            if self._delivered():
+                message = InertialMessage(timestamp_us, *inertial)
+                for callback in self.inertial_callbacks:
+                    callback(message)
+            if self._delivered():
+                message = EulerAnglesMessage(timestamp_us, *euler_angles)
+                for callback in self.euler_angles_callbacks:
+                    callback(message)
+
+    def _delivered(self):
+        if self.packet_loss > 0 and self.random.random() < self.packet_loss:
+            self.dropped_messages += 1
+            return False
+        self.sent_messages += 1
+        return True
+
+
+class ReplayConnectionList():
+    """
+    Drop-in for ConnectionSetup.ConnectionList that replays both devices of one recorded experiment,
+    each on its own thread, from a shared start time and kept in step by a ReplayPace.
+    """
+    def __init__(self, folder_path, rate=1.0, jitter_ms=0.0, packet_loss=0.0, seed=None):
+        pace = ReplayPace()
+        self.wrist_connection = ReplayConnection.from_experiment(folder_path, 'wrist', rate=rate, jitter_ms=jitter_ms,
+                                                                 packet_loss=packet_loss, seed=seed, pace=pace)
+        arm_seed = None if seed is None else seed + 1
+        self.arm_connection = ReplayConnection.from_experiment(folder_path, 'arm', rate=rate, jitter_ms=jitter_ms,
+                                                               packet_loss=packet_loss, seed=arm_seed, pace=pace)
+
+    def get_connections(self):
+        return [self.wrist_connection, self.arm_connection]
+
+    def get_wrist_connection(self):
+        return self.wrist_connection
+
+    def get_arm_connection(self):
+        return self.arm_connection
+
+    def checkOpenAll(self):
+        return all(connection.is_playing() for connection in self.get_connections())
+
+    def openAll(self):
+        start_time = time.perf_counter()
+        for connection in self.get_connections():
+            connection.pace.start(connection)
+        for connection in self.get_connections():
+            connection.open(start_time)
+
+    def closeAll(self):
+        for connection in self.get_connections():
+            connection.close()
+
+    def join(self, timeout=None):
+        for connection in self.get_connections():
+            connection.join(timeout)
@@ -0,0 +1,78 @@
+import numpy as np
+
+class SampleBuffer():
+    """
+    Growable float64 2-D sample store with one column per channel and one write cursor per stream.
+    Each stream owns a fixed set of columns and fills the next row of them on every write, so rows are
+    addressed by sample index and a range of rows is a zero-copy slice of the underlying array.
+    Missing values are NaN. Rows that are no longer needed can be discarded to bound memory; row indices
+    stay absolute, with self.offset being the first row still held.
+    """
+    def __init__(self, columns, streams, initial_capacity=4096):
+        self.columns = list(columns)
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+        self.streams = {stream: np.array([self.column_index[column] for column in stream_columns])
+                        for stream, stream_columns in streams.items()}
+        self.cursors = dict.fromkeys(streams, 0)
+        self.offset = 0
+        self.array = np.full((initial_capacity, len(self.columns)), np.nan)
+
+    def __len__(self):
+        """
+        Number of rows written to by at least one stream.
+        """
+        return max(self.cursors.values())
+
+    def write(self, stream, values):
+        """
+        Writes the next row of the stream's columns and returns its row index.
+        """
+        row = self.cursors[stream]
+        self._reserve(row + 1)
+        self.array[row - self.offset, self.streams[stream]] = values
+        self.cursors[stream] = row + 1
+        return row
+
+    def set(self, row, column, value):
+        self.array[row - self.offset, column] = value
+
+    def rows(self, start, end):
+        """
+        Rows start to end (exclusive) as a view into the store; invalidated when the store grows or is trimmed.
+        """
+        return self.array[start - self.offset:end - self.offset]
+
+    def column(self, column, start=None, end=None):
+        start = self.offset if start is None else start
+        end = len(self) if end is None else end
+        return self.array[start - self.offset:end - self.offset, column]
+
+    def complete_rows(self):
+        """
+        Number of leading rows that every stream has written.
+        """
+        return min(self.cursors.values())
+
+    def discard_before(self, row):
+        """
+        Drops every row before the given one. The remaining rows are moved to the front of the array,
+        so the capacity stops growing once old rows are discarded as fast as new ones arrive.
+        """
+        row = min(row, len(self))
+        if row <= self.offset:
+            return
+        num_kept = len(self) - row
+        self.array[:num_kept] = self.array[row - self.offset:len(self) - self.offset].copy()
+        self.array[num_kept:len(self) - self.offset] = np.nan
+        self.offset = row
+
+    def _reserve(self, num_rows):
+        num_rows -= self.offset
+        capacity = self.array.shape[0]
+        if num_rows <= capacity:
+            return
+        while capacity < num_rows:
+            capacity *= 2
+        grown = np.full((capacity, len(self.columns)), np.nan)
+        grown[:self.array.shape[0]] = self.array
+        self.array = grown
@@ -0,0 +1,122 @@
+import json
+import os
+import queue
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+class SessionRecorder():
+    """
+    Streams a session to disk while it runs.
+    Complete sample rows are appended in chunks to imu_data.bin (raw float64, column names in imu_data.json),
+    repetitions are appended to repetitions.csv, gaps in the aligned streams to gaps.csv and predictions to
+    rnn_predictions.bin, all from a background writer thread that fsyncs periodically. A crash loses at most the chunks not yet written.
+    On close, the writer derives imu_data.csv and rnn_predictions.npy; export_session does the same offline.
+    """
+    def __init__(self, folder_path, columns, time_column, fsync_every=10):
+        self.folder_path = folder_path
+        self.columns = list(columns)
+        self.fsync_every = fsync_every
+        self.num_rows = 0
+        self.num_writes = 0
+
+        with open(f'{folder_path}/imu_data.json', 'w') as f:
+            json.dump({'columns': self.columns, 'time column': time_column, 'dtype': '<f8'}, f)
+        self.imu_file = open(f'{folder_path}/imu_data.bin', 'ab')
+        self.predictions_file = open(f'{folder_path}/rnn_predictions.bin', 'ab')
+        self.repetitions_file = open(f'{folder_path}/repetitions.csv', 'w')
+        self.repetitions_file.write('start (index),end (index)\n')
+        self.gaps_file = open(f'{folder_path}/gaps.csv', 'w')
+        self.gaps_file.write('start (index),end (index)\n')
+
+        self.write_queue = queue.Queue()
+        # not a daemon, so a close requested right before the app exits still gets exported
+        self.writer = threading.Thread(target=self._write, daemon=False)
+        self.writer.start()
+
+    def append_rows(self, rows):
+        """
+        Queues a block of complete rows. The block is copied, so the caller may reuse its buffer.
+        """
+        self.write_queue.put(('rows', np.array(rows, dtype='<f8')))
+        self.num_rows += len(rows)
+
+    def append_repetition(self, start_point, end_point, prediction):
+        self.write_queue.put(('repetition', (start_point, end_point, prediction)))
+
+    def append_gap(self, start_row, end_row):
+        self.write_queue.put(('gap', (start_row, end_row)))
+
+    def close(self):
+        """
+        Returns immediately; the writer thread flushes what is queued and exports the session files.
+        """
+        self.write_queue.put(('close', None))
+
+    def wait(self):
+        self.writer.join()
+
+    def _write(self):
+        while True:
+            kind, item = self.write_queue.get()
+            if kind == 'rows':
+                self.imu_file.write(item.tobytes())
+            elif kind == 'repetition':
+                start_point, end_point, prediction = item
+                self.repetitions_file.write(f'{start_point},{end_point}\n')
+                self.predictions_file.write(np.array([prediction], dtype='<f8').tobytes())
+            elif kind == 'gap':
+                self.gaps_file.write('{},{}\n'.format(*item))
+            elif kind == 'close':
+                break
+            self.num_writes += 1
+            if self.num_writes % self.fsync_every == 0:
+                self._sync()
+
+        self._sync()
+        for f in [self.imu_file, self.predictions_file, self.repetitions_file, self.gaps_file]:
+            f.close()
+        export_session(self.folder_path)
+
+    def _sync(self):
+        for f in [self.imu_file, self.predictions_file, self.repetitions_file, self.gaps_file]:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_session(folder_path):
+    """
+    Reads imu_data.bin back as a (rows, columns) array, together with its column names and time column.
+    """
+    with open(f'{folder_path}/imu_data.json') as f:
+        meta = json.load(f)
+    data = np.fromfile(f'{folder_path}/imu_data.bin', dtype=meta['dtype'])
+    num_columns = len(meta['columns'])
+    # a crash can leave a partially written last row
+    data = data[:len(data) // num_columns * num_columns].reshape(-1, num_columns)
+    return data, meta['columns'], meta['time column']
+
+
+def export_session(folder_path):
+    """
+    Derives imu_data.csv and rnn_predictions.npy from the files written by SessionRecorder.
+    """
+    data, columns, time_column = read_session(folder_path)
+    time_index = columns.index(time_column)
+    channel_columns = [column for column in columns if column != time_column]
+    data_df = pd.DataFrame(np.delete(data, time_index, axis=1), columns=channel_columns)
+    host_times = data[:, time_index]
+    min_time = np.nanmin(host_times) if len(host_times) > 0 else 0
+    data_df.index = pd.Index((host_times - min_time) * 1000, name='Timestamp (ms)')
+    data_df.dropna(inplace=True)
+    data_df.to_csv(f"{folder_path}/imu_data.csv", index=True)
+
+    predictions = np.fromfile(f'{folder_path}/rnn_predictions.bin', dtype='<f8')
+    np.save(f'{folder_path}/rnn_predictions.npy', predictions)
+    print(f'Session exported to {folder_path}')
+
+
+if __name__ == '__main__':
+    # offline recovery, e.g. after a crash: python System/SessionRecorder.py <folder_path>
+    export_session(sys.argv[1])
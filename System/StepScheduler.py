@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import Counter, deque
+import numpy as np
+from IncrementalRNN import IncrementalRNN
+
+class ScheduledRNN():
+    """
+    Per-session stand-in for IncrementalRNN whose steps are batched with those of other sessions by a StepScheduler.
+    The session's LSTM state lives here; step() blocks until the scheduler has run the batch holding it.
+    """
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.mask_value = scheduler.rnn.mask_value
+        self.closed = False
+        self.reset()
+
+    def reset(self):
+        self.states = [np.zeros(self.scheduler.rnn.units, dtype='float32'), np.zeros(self.scheduler.rnn.units, dtype='float32')]
+        self.last_prediction = None
+
+    def step(self, x):
+        """
+        Advances the LSTM by one timestep with the feature vector x and returns the prediction for it.
+        """
+        x = np.asarray(x, dtype='float32').reshape(-1)
+        if self.mask_value is not None and np.all(x == self.mask_value):
+            # masked timesteps leave the state untouched and repeat the previous output, as in the Masking layer
+            return self.last_prediction
+        self.last_prediction = self.scheduler.submit(self, x)
+        return self.last_prediction
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.scheduler.release(self)
+
+
+class _Request():
+    __slots__ = ('session', 'x', 'submitted', 'done', 'prediction', 'error')
+
+    def __init__(self, session, x):
+        self.session = session
+        self.x = x
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.prediction = None
+        self.error = None
+
+
+class StepScheduler():
+    """
+    Advances the LSTM of many concurrent sessions in one batched cell call instead of one call per session.
+    A batch is run as soon as max_batch_size steps, or every open session, are waiting, and at the latest
+    max_wait_ms after its first step arrived. Each session has at most one step waiting, since step() blocks.
+    Works with a Keras model or a NumpyLSTM, like IncrementalRNN.
+    """
+    def __init__(self, model, max_batch_size=16, max_wait_ms=2.0, metrics_window=10000):
+        self.rnn = IncrementalRNN(model)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pending = []
+        self.num_sessions = 0
+        self.condition = threading.Condition()
+        self.running = True
+        # for metrics(): running counts, and the times of the latest metrics_window batches / steps
+        self.num_batches = 0
+        self.batch_size_counts = Counter()
+        self.batch_times = deque(maxlen=metrics_window)
+        self.waits = deque(maxlen=metrics_window)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def session(self):
+        """
+        A new ScheduledRNN with a zero state; close() it when the session ends.
+        """
+        with self.condition:
+            self.num_sessions += 1
+        return ScheduledRNN(self)
+
+    def release(self, session):
+        with self.condition:
+            self.num_sessions -= 1
+            # the remaining sessions may all be waiting already
+            self.condition.notify()
+
+    def submit(self, session, x):
+        request = _Request(session, x)
+        with self.condition:
+            if not self.running:
+                raise RuntimeError('StepScheduler is closed')
+            self.pending.append(request)
+            self.condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.prediction
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running and not self.pending:
+                    return
+                deadline = self.pending[0].submitted + self.max_wait
+                while self.running and len(self.pending) < min(self.max_batch_size, max(self.num_sessions, 1)):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_batch_size]
+                del self.pending[:len(batch)]
+            self._step(batch)
+
+    def _step(self, batch):
+        start = time.perf_counter()
+        try:
+            x = np.stack([request.x for request in batch])
+            states = [np.stack([request.session.states[0] for request in batch]),
+                      np.stack([request.session.states[1] for request in batch])]
+            h, (_, c) = self.rnn.lstm_step(x, states)
+            h, c = np.asarray(h), np.asarray(c)
+            predictions = np.asarray(self.rnn.output(h)).reshape(-1)
+            for i, request in enumerate(batch):
+                request.session.states = [h[i], c[i]]
+                request.prediction = float(predictions[i])
+        except Exception as error:
+            for request in batch:
+                request.error = error
+        self.num_batches += 1
+        self.batch_size_counts[len(batch)] += 1
+        self.batch_times.append(time.perf_counter() - start)
+        self.waits.extend(start - request.submitted for request in batch)
+        for request in batch:
+            request.done.set()
+
+    def metrics(self):
+        """
+        Achieved batch sizes, the latency the scheduler added to each step (waiting for its batch) and the
+        time of each batched cell call, in milliseconds. Latencies and call times cover the latest metrics_window.
+        """
+        if not self.num_batches:
+            return {'batches': 0, 'steps': 0}
+        num_steps = sum(size * count for size, count in self.batch_size_counts.items())
+        waits_ms = np.array(self.waits) * 1000
+        batch_times_ms = np.array(self.batch_times) * 1000
+        return {
+            'batches': self.num_batches,
+            'steps': num_steps,
+            'mean batch size': num_steps / self.num_batches,
+            'max batch size': max(self.batch_size_counts),
+            'batch size counts': dict(sorted(self.batch_size_counts.items())),
+            'added latency p50 ms': float(np.percentile(waits_ms, 50)),
+            'added latency p95 ms': float(np.percentile(waits_ms, 95)),
+            'added latency max ms': float(waits_ms.max()),
+            'batch step mean ms': float(batch_times_ms.mean()),
+        }
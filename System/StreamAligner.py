@@ -0,0 +1,237 @@
+import bisect
+import numpy as np
+
+class _DeviceClock():
+    """
+    Maps the microsecond timestamps of one device to seconds on a continuous device timeline, and estimates
+    the offset from that timeline to host time as the smallest host - device difference seen, i.e. that of the
+    least delayed message. The estimate may rise by drift_ppm of the elapsed device time, so it follows a device
+    clock that runs slower than the host's.
+    A timestamp more than resync_s behind the newest one means the device restarted its clock; the timeline
+    then continues where the host time says it is, and the offset is estimated afresh.
+    """
+    def __init__(self, period, drift_ppm=100, resync_s=1.0):
+        self.period = period
+        self.drift = drift_ppm / 1e6
+        self.resync_s = resync_s
+        self.correction = 0.0
+        self.newest = None
+        self.offset = None
+        self.restarts = 0
+
+    def update(self, timestamp_us, host_time):
+        """
+        Returns the device time of the message in seconds, after updating the offset with its host arrival time.
+        """
+        device_time = timestamp_us / 1e6 + self.correction
+        if self.newest is not None and device_time < self.newest - self.resync_s:
+            continued = max(self.newest + self.period, host_time - self.offset)
+            self.correction += continued - device_time
+            device_time = continued
+            self.offset = None
+            self.restarts += 1
+        if self.offset is None:
+            self.offset = host_time - device_time
+        else:
+            if device_time > self.newest:
+                self.offset += self.drift * (device_time - self.newest)
+            self.offset = min(self.offset, host_time - device_time)
+        self.newest = device_time if self.newest is None else max(self.newest, device_time)
+        return device_time
+
+
+class StreamAligner():
+    """
+    Merges sample streams from several devices onto one grid of period_ms, using the timestamps the devices put
+    in their messages instead of the order in which the messages arrive.
+    Each device clock is mapped onto the clock of reference_device through the host arrival times (_DeviceClock),
+    and every stream is linearly interpolated at the grid times, so a lost or late message on one stream never
+    shifts the others. No row is emitted before every stream has a sample at or before it, and until then each
+    buffer keeps only its newest max_samples. A grid time is emitted once the newest sample is reorder_ms past it
+    and every stream has a sample after it. A stream that has not got there is waited for up to max_delay_ms of
+    host time, or until a buffer holds max_samples, and then holds its last value. Rows where a stream was held,
+    or interpolated across more than max_gap_ms, are flagged as gaps. Samples older than the last emitted row are
+    dropped as late. The host times of the rows always increase (_host_time).
+    For a recording replayed faster than real time, arrival times mean nothing: with shared_clock the device
+    timestamps are taken as one clock instead of being mapped through them, and a stream that has not reached a
+    row is always waited for, so the replay must keep its devices in step (ReplayConnectionList does).
+    - streams: {stream: number of values}, devices: {stream: device}
+    - angle_columns: {stream: positions of values in degrees that wrap around at ±180}
+    """
+    def __init__(self, streams, devices, reference_device, period_ms=20, reorder_ms=40, max_delay_ms=200, max_gap_ms=100,
+                 max_samples=1000, angle_columns=None, shared_clock=False, drift_ppm=100, resync_s=1.0):
+        self.streams = dict(streams)
+        self.devices = dict(devices)
+        self.reference_device = reference_device
+        self.shared_clock = shared_clock
+        self.period = period_ms / 1000
+        self.reorder = reorder_ms / 1000
+        self.max_delay = None if max_delay_ms is None else max_delay_ms / 1000
+        self.max_gap = max_gap_ms / 1000
+        self.max_samples = max_samples
+        self.angle_masks = {stream: np.isin(np.arange(num_values), (angle_columns or {}).get(stream, []))
+                            for stream, num_values in self.streams.items()}
+        self.clocks = {device: _DeviceClock(self.period, drift_ppm, resync_s) for device in set(self.devices.values())}
+        # reorder buffers: sample times on the reference clock, in order, and the matching values
+        self.times = {stream: [] for stream in self.streams}
+        self.values = {stream: [] for stream in self.streams}
+        self.newest = None
+        self.next_time = None
+        self.last_time = None
+        self.host_offset = None
+        self.last_host_time = None
+        self.waiting_since = None
+        self.num_rows = 0
+        self.gap_rows = 0
+        self.interpolated_rows = 0
+        self.late_samples = 0
+        self.unsynced_samples = 0
+        self.max_buffered = 0
+
+    def add(self, stream, timestamp_us, values, host_time):
+        """
+        Adds one sample and returns the rows it completed, as (host time, {stream: values}, streams with a gap).
+        """
+        device = self.devices[stream]
+        device_time = self.clocks[device].update(timestamp_us, host_time)
+        reference = self.clocks[self.reference_device]
+        if self.shared_clock:
+            sample_time = device_time
+        elif reference.offset is None:
+            # nothing to map this device onto before the reference device has been heard from
+            self.unsynced_samples += 1
+            return []
+        else:
+            sample_time = device_time + self.clocks[device].offset - reference.offset
+        if self.last_time is not None and sample_time <= self.last_time:
+            self.late_samples += 1
+            return []
+        times = self.times[stream]
+        position = bisect.bisect_right(times, sample_time)
+        times.insert(position, sample_time)
+        self.values[stream].insert(position, np.asarray(values, dtype=float))
+        self.newest = sample_time if self.newest is None else max(self.newest, sample_time)
+        self.max_buffered = max(self.max_buffered, sum(map(len, self.times.values())))
+        return self._emit(host_time)
+
+    def flush(self):
+        """
+        Emits the rows up to the newest sample, holding the streams that have not reached them; nothing if a
+        stream never arrived.
+        """
+        return self._emit(until=self.newest)
+
+    def _emit(self, host_time=None, until=None):
+        rows = []
+        if self.newest is None:
+            return rows
+        if self.next_time is None:
+            if not all(self.times.values()):
+                # a row without one of the streams would have nothing to hold for it
+                for stream, times in self.times.items():
+                    del times[:-self.max_samples]
+                    del self.values[stream][:-self.max_samples]
+                return rows
+            # the first grid time every stream has a sample at or before
+            self.next_time = max(times[0] for times in self.times.values())
+        while True:
+            grid_time = self.next_time
+            if until is not None:
+                if grid_time > until:
+                    return rows
+            elif self.newest - grid_time < self.reorder:
+                return rows
+            elif all(times and times[-1] >= grid_time for times in self.times.values()):
+                self.waiting_since = None
+            elif not self._waited(host_time):
+                return rows
+            rows.append(self._row(grid_time))
+            self.last_time = grid_time
+            self.next_time = grid_time + self.period
+
+    def _waited(self, host_time):
+        """
+        Whether the rows have waited long enough for a stream that has not reached them, measured in host time so
+        that devices replayed faster than real time are waited for too, and never past a buffer of max_samples.
+        Once a stream is being held, every row is emitted without waiting until all streams are back.
+        With a shared clock a replayed stream that is behind has not been lost, so it is never given up on.
+        """
+        if self.shared_clock:
+            return False
+        if max(map(len, self.times.values())) > self.max_samples:
+            return True
+        if self.max_delay is None:
+            return False
+        if self.waiting_since is None:
+            self.waiting_since = host_time
+        return host_time - self.waiting_since > self.max_delay
+
+    def _row(self, grid_time):
+        row, gaps = {}, []
+        interpolated = False
+        for stream, times in self.times.items():
+            values = self.values[stream]
+            right = bisect.bisect_right(times, grid_time)
+            left = right - 1
+            if times[left] == grid_time:
+                row[stream] = values[left]
+            elif right == len(times):
+                row[stream] = values[left]
+                gaps.append(stream)
+            else:
+                span = times[right] - times[left]
+                row[stream] = self._interpolate(stream, values[left], values[right], (grid_time - times[left]) / span)
+                if span > self.max_gap:
+                    gaps.append(stream)
+                elif span > 1.5 * self.period:
+                    interpolated = True
+            # only the last sample at or before the grid time can bracket a later one
+            del times[:left]
+            del values[:left]
+        self.num_rows += 1
+        self.gap_rows += bool(gaps)
+        self.interpolated_rows += interpolated and not gaps
+        return self._host_time(grid_time), row, gaps
+
+    def _host_time(self, grid_time):
+        """
+        Host time of a row: its grid time plus the reference offset, frozen at the first row. Live, the frozen
+        offset then follows the estimate by at most a tenth of a period per row, so host times track the clock
+        but always increase; with a shared clock the estimate comes from arrival times that mean nothing.
+        """
+        offset = self.clocks[self.reference_device].offset
+        if self.host_offset is None:
+            self.host_offset = offset
+        elif not self.shared_clock:
+            self.host_offset += np.clip(offset - self.host_offset, -self.period / 10, self.period / 10)
+        host_time = grid_time + self.host_offset
+        assert self.last_host_time is None or host_time > self.last_host_time
+        self.last_host_time = host_time
+        return host_time
+
+    def _interpolate(self, stream, before, after, fraction):
+        difference = after - before
+        mask = self.angle_masks[stream]
+        if mask.any():
+            difference[mask] = (difference[mask] + 180) % 360 - 180
+            value = before + fraction * difference
+            value[mask] = (value[mask] + 180) % 360 - 180
+            return value
+        return before + fraction * difference
+
+    def stats(self):
+        reference = self.clocks[self.reference_device]
+        return {
+            'rows': self.num_rows,
+            'gap rows': self.gap_rows,
+            'interpolated rows': self.interpolated_rows,
+            'late samples': self.late_samples,
+            'unsynced samples': self.unsynced_samples,
+            'buffered samples': sum(map(len, self.times.values())),
+            'max buffered samples': self.max_buffered,
+            # with a shared clock the devices are not mapped, so there are no offsets between them
+            'clock offsets ms': None if self.shared_clock else {
+                device: None if clock.offset is None or reference.offset is None else 1000 * (clock.offset - reference.offset)
+                for device, clock in self.clocks.items()},
+            'clock restarts': sum(clock.restarts for clock in self.clocks.values()),
+        }
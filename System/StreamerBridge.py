@@ -0,0 +1,48 @@
+import threading
+from PySide6.QtCore import QObject, Qt, Signal
+
+class StreamerBridge(QObject):
+    """
+    Hands DataStreamer events from its worker thread to the Qt UI thread.
+    publish() only stores the newest StreamerEvent and, unless a delivery is already queued, posts one queued
+    signal; the UI thread then emits event_received with the newest event. A burst of events between two
+    UI turns therefore becomes a single update, and the UI never reads DataStreamer's lists itself.
+    Create it on the UI thread and subscribe its publish method to the DataStreamer.
+    """
+    event_received = Signal(object)
+    _wake = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        self.latest = None
+        self.pending = False
+        self.published = 0
+        self.delivered = 0
+        self._wake.connect(self._deliver, Qt.ConnectionType.QueuedConnection)
+
+    def publish(self, event):
+        """
+        Called on the DataStreamer worker thread.
+        """
+        with self.lock:
+            self.latest = event
+            self.published += 1
+            if self.pending:
+                return
+            self.pending = True
+        self._wake.emit()
+
+    def _deliver(self):
+        with self.lock:
+            event = self.latest
+            self.pending = False
+            self.delivered += 1
+        self.event_received.emit(event)
+
+    def stats(self):
+        """
+        Events published by the worker and UI updates they were coalesced into.
+        """
+        with self.lock:
+            return {'published': self.published, 'delivered': self.delivered}
@@ -7,9 +7,11 @@ import pandas as pd
 from datetime import datetime
 from functools import partial
 from DataStreamer import DataStreamer
+from StreamerBridge import StreamerBridge
+from PitchPlot import PitchPlot
 
 class TestAndCollectPage(QWidget):
-    def __init__(self, switch_page_callback, folder_path, connections):
+    def __init__(self, switch_page_callback, folder_path, connections, model_loader=None):
         super().__init__()
         self.switch_page_callback = switch_page_callback
         self.folder_path = folder_path
@@ -26,7 +28,7 @@ class TestAndCollectPage(QWidget):
         # two paned splitter
         middle_container = QWidget()
         middle_layout = QHBoxLayout(middle_container)
-        self.tester = TesterPage(folder_path, connections)
+        self.tester = TesterPage(folder_path, connections, model_loader)
         middle_layout.addWidget(self.tester)
         middle_layout.setStretch(0, 1)
         middle_layout.setStretch(1, 0)
@@ -58,7 +60,7 @@ class TestAndCollectPage(QWidget):
 
 
 class TesterPage(QWidget):
-    def __init__(self, folder_path, connections):
+    def __init__(self, folder_path, connections, model_loader=None):
         super().__init__()
         container = QWidget()
         container.setStyleSheet("background-color: lightblue;") 
@@ -66,6 +68,7 @@ class TesterPage(QWidget):
 
         self.folder_path = folder_path
         self.connections = connections
+        self.model_loader = model_loader
 
         labels_widget = QWidget()
         labels_layout = QVBoxLayout(labels_widget)
@@ -80,6 +83,10 @@ class TesterPage(QWidget):
         labels_layout.addWidget(self.title6, alignment=Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(labels_widget, alignment=Qt.AlignmentFlag.AlignCenter)
 
+        # live arm minus wrist pitch with its peaks and repetitions, fed by the DataStreamer worker
+        self.pitch_plot = PitchPlot(window_seconds=20, refresh_hz=20)
+        layout.addWidget(self.pitch_plot)
+
         self.robot_label = QLabel()
         self.robot_movie = QMovie("/Users/erinliu/Downloads/1 Muscle Fatigue/xIMU3/Data_Collection/giphy.gif")
         self.robot_label.setMovie(self.robot_movie)
@@ -97,27 +104,30 @@ class TesterPage(QWidget):
 
     def initiate_plot(self):
         self.dataStreamer = None
-        self.plot_data = []
-        self.peaks = []
+        # the labels are redrawn only when the DataStreamer publishes a new peak or prediction
+        self.streamer_bridge = StreamerBridge(self)
+        self.streamer_bridge.event_received.connect(self.update_plot)
 
     def start(self):
         self.wrist_connection = self.connections.get_wrist_connection()
         self.arm_connection = self.connections.get_arm_connection()
-        self.dataStreamer = DataStreamer(self.wrist_connection, self.arm_connection)
-        self.dataStreamer.peaks = self.peaks
-        self.dataStreamer.pitch_data = self.plot_data
-        self.plot_timer = QTimer()
-        self.plot_timer.timeout.connect(self.update_plot)
-        self.plot_timer.start(100)  # Update every 100 milliseconds
+        self.dataStreamer = DataStreamer(self.wrist_connection, self.arm_connection, folder_path=self.folder_path,
+                                         model_loader=self.model_loader, pitch_trace=self.pitch_plot.trace)
+        self.dataStreamer.subscribe(self.streamer_bridge.publish)
+        self.pitch_plot.start()
 
 
     def end(self):
+        self.dataStreamer.unsubscribe(self.streamer_bridge.publish)
+        self.pitch_plot.stop()
         self.dataStreamer.end(self.folder_path)
+        print(f'UI updates: {self.streamer_bridge.stats()}')
+        print(f'Pitch plot: {self.pitch_plot.stats()}')
 
-    def update_plot(self):
+    def update_plot(self, event):
 
-        self.numReps.setText(f"Number of Repetitions: {len(self.peaks)}")
-        self.title6.setText(f"Prediction: {self.dataStreamer.fatigue}")
+        self.numReps.setText(f"Number of Repetitions: {event.num_peaks}")
+        self.title6.setText(f"Prediction: {event.fatigue}")
 
 
 class CollectorPage(QWidget):
@@ -0,0 +1,102 @@
+import socket
+import threading
+from ReplayConnection import EulerAnglesMessage, InertialMessage
+
+def format_message(message):
+    """
+    x-IMU3 ASCII line of an euler angles ("A,timestamp,roll,pitch,yaw") or inertial
+    ("I,timestamp,gyroscope xyz,accelerometer xyz") message, timestamp in microseconds.
+    """
+    if isinstance(message, EulerAnglesMessage):
+        return f'A,{message.timestamp},{message.roll!r},{message.pitch!r},{message.yaw!r}\r\n'
+    return (f'I,{message.timestamp},{message.gyroscope_x!r},{message.gyroscope_y!r},{message.gyroscope_z!r},'
+            f'{message.accelerometer_x!r},{message.accelerometer_y!r},{message.accelerometer_z!r}\r\n')
+
+def parse_message(line):
+    """
+    EulerAnglesMessage or InertialMessage of an x-IMU3 ASCII line, None for other or malformed lines.
+    """
+    fields = line.strip().split(',')
+    try:
+        if fields[0] == 'A' and len(fields) == 5:
+            return EulerAnglesMessage(int(fields[1]), *map(float, fields[2:]))
+        if fields[0] == 'I' and len(fields) == 8:
+            return InertialMessage(int(fields[1]), *map(float, fields[2:]))
+    except ValueError:
+        pass
+    return None
+
+
+class UdpSender():
+    """
+    Callback for ReplayConnection that sends every message to a UDP address as an x-IMU3 ASCII line,
+    so a replay can stand in for a device on the network.
+    """
+    def __init__(self, address):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, message):
+        self.socket.sendto(format_message(message).encode('ascii'), self.address)
+
+    def close(self):
+        self.socket.close()
+
+
+class UdpConnection():
+    """
+    Stand-in for a ximu3.Connection that receives x-IMU3 ASCII messages on a local UDP port.
+    Exposes the add_euler_angles_callback / add_inertial_callback surface used by DataStreamer.start().
+    The port is bound on creation (port 0 picks a free one, see self.address); messages are dispatched
+    on a receive thread from open() until close().
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.address = self.socket.getsockname()
+        self.euler_angles_callbacks = []
+        self.inertial_callbacks = []
+        self.received_messages = 0
+        self.malformed_messages = 0
+        self.thread = None
+
+    def add_euler_angles_callback(self, callback):
+        self.euler_angles_callbacks.append(callback)
+
+    def add_inertial_callback(self, callback):
+        self.inertial_callbacks.append(callback)
+
+    def open(self):
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        # shutdown wakes the blocked recvfrom, which then returns nothing
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def is_open(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _receive(self):
+        while True:
+            try:
+                datagram, _ = self.socket.recvfrom(65536)
+            except OSError:
+                return
+            if not datagram:
+                return
+            for line in datagram.decode('ascii', errors='replace').splitlines():
+                message = parse_message(line)
+                if message is None:
+                    self.malformed_messages += 1
+                    continue
+                self.received_messages += 1
+                callbacks = self.euler_angles_callbacks if isinstance(message, EulerAnglesMessage) else self.inertial_callbacks
+                for callback in callbacks:
+                    callback(message)
@@ -1,7 +1,12 @@
+import time
+# measured from before the imports, so time-to-first-frame includes them
+LAUNCH_TIME = time.perf_counter()
 import os
 from SetupPage import SetupPage
 from BasicInformationPage import BasicInformationPage
 from TestAndCollectPage import TestAndCollectPage
+from ModelLoader import ModelLoader
+from PySide6.QtCore import QTimer
 from PySide6.QtWidgets import (QApplication, QMainWindow, QStackedWidget)
 import PySide6.QtAsyncio as QtAsyncio
 import sys
@@ -10,6 +15,9 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
 
+        # the RNN and scaler load and warm up in the background while the setup pages are in use
+        self.model_loader = ModelLoader()
+
         self.setWindowTitle("Online Fatigue Model")
         self.showFullScreen()
         
@@ -40,7 +48,7 @@ class MainWindow(QMainWindow):
         self.folder_path = folder_path
 
         # creating page 3 : Model Test / Data Collection Page
-        self.page3 = TestAndCollectPage(self.close, folder_path, self.connections)
+        self.page3 = TestAndCollectPage(self.close, folder_path, self.connections, self.model_loader)
         self.stacked_widget.addWidget(self.page3)
         self.stacked_widget.setCurrentWidget(self.page3)
         
@@ -66,9 +74,15 @@ class MainWindow(QMainWindow):
         os.makedirs(folder_path)
         return folder_path
 
+    def report_first_frame(self):
+        print(f'Time to first frame: {time.perf_counter() - LAUNCH_TIME:.2f} s '
+              f'(models {"ready" if self.model_loader.is_ready() else "still loading"})')
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     main_window = MainWindow()
     main_window.show()
+    # runs once the event loop has drawn the window
+    QTimer.singleShot(0, main_window.report_first_frame)
 
     QtAsyncio.run()
\ No newline at end of file